@@ -1,6 +1,19 @@
+import hashlib
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class CrawlerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crawler'
+
+    def ready(self) -> None:
+        # PDF hashing relies on OpenSSL's SHA-256, which uses SHA-NI / ARMv8 crypto
+        # extensions when the CPU has them; the builtin fallback is several times slower
+        if hashlib.sha256.__module__ != "_hashlib":
+            logger.warning("hashlib.sha256 is not backed by OpenSSL; PDF hashing will be slow")
+        else:
+            logger.debug("hashlib.sha256 backed by OpenSSL (%s)", hashlib.sha256().name)
@@ -1,17 +1,25 @@
 import hashlib
+import json
 import logging
 import os
 import re
+import threading
 import time
 from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
+from email.utils import formatdate
 from pathlib import Path
-from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
-from urllib.parse import ParseResult, urljoin, urldefrag, urlparse, quote, unquote, parse_qs
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import SplitResult, urljoin, urldefrag, urlsplit, quote, unquote, parse_qs
 
 import bs4
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 HEADERS = {
     "User-Agent": (
@@ -27,9 +35,56 @@ HEADERS = {
 
 VERIFY_SSL = os.getenv("CRAWLER_VERIFY_SSL", "true").lower() not in {"0", "false", "no"}
 
-_SESSION = requests.Session()
-_SESSION.headers.update(HEADERS)
-_SESSION.verify = VERIFY_SSL
+# Number of PDFs downloaded in parallel; workers share _SESSION
+DOWNLOAD_WORKERS = int(os.getenv("CRAWLER_DOWNLOAD_WORKERS", "8"))
+
+# Default retry policy: attempts after the first, and the urllib3 backoff factor in
+# seconds (sleeps of delay, 2 * delay, 4 * delay, ... between attempts)
+HTTP_RETRIES = int(os.getenv("CRAWLER_HTTP_RETRIES", "3"))
+HTTP_RETRY_DELAY = float(os.getenv("CRAWLER_HTTP_RETRY_DELAY", "0.5"))
+
+
+@lru_cache(maxsize=8)
+def _retrying_session(retries: int, delay: float) -> requests.Session:
+    """
+    Return the shared session that retries requests with the given policy.
+
+    urllib3 retries connection failures, connection resets and transient 5xx
+    responses with exponential backoff; this is the only retry layer, nothing
+    in the crawler loops on failed requests. Other errors, certificate
+    failures among them, are not retried, so _request_with_ssl_fallback can
+    fall back at once.
+    """
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.verify = VERIFY_SSL
+    retry = Retry(
+        total=retries,
+        other=0,
+        backoff_factor=delay,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    # Size the connection pool above the worker count so downloads reuse connections
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_SESSION = _retrying_session(HTTP_RETRIES, HTTP_RETRY_DELAY)
+
+# Chunk size used when streaming PDF bodies to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# How far into a response to look for the %PDF- header past any debug output
+PDF_HEADER_SEARCH_LIMIT = 1024 * 1024
+
+# Link extensions never queued for crawling; PDFs are downloaded separately
+SKIP_EXTENSIONS = (
+    '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.css', '.js', '.ico', '.svg', '.woff', '.ttf', '.mp4', '.mp3',
+)
 
 PDF_PATTERN = re.compile(r"[^'\"()<>\\\s]+\.pdf(?:[?#][^'\"()<>\\\s]*)?", re.IGNORECASE)
 
@@ -39,10 +94,37 @@ ONCLICK_PDF_PATTERN = re.compile(
     re.IGNORECASE
 )
 
+# Pattern to recognise watermark download links in href attributes:
+# 1. watermark*/download.php
+# 2. other watermark patterns (getpdf, showpdf, viewpdf, downloadpdf)
+WATERMARK_HREF_PATTERN = re.compile(
+    r"watermark.*download\.php|download\.php.*watermark|getpdf|showpdf|viewpdf|downloadpdf",
+    re.IGNORECASE | re.DOTALL
+)
+
+# Characters not allowed in file names, mapped to underscore for str.translate
+_UNSAFE_FILENAME_CHARS = str.maketrans({c: '_' for c in '<>:"/\\|?*' + ''.join(map(chr, range(32)))})
+
 logger = logging.getLogger(__name__)
 
 _STATUS_SUBSCRIBERS: List[Callable[[str, Dict[str, object]], None]] = []
 
+# Subscribers hear at most one status update per interval, except for terminal states
+STATUS_THROTTLE_SECONDS = 1.0
+_TERMINAL_STATES = {"Completed", "Failed"}
+_status_lock = threading.Lock()
+_last_status_sent = 0.0
+_pending_status_context: Dict[str, object] = {}
+
+# Target files reserved by in-flight downloads, so parallel workers never pick the same name
+_target_path_lock = threading.Lock()
+_claimed_target_paths: Set[Path] = set()
+
+# File in each download folder recording where its PDFs came from
+MANIFEST_NAME = ".crawler-manifest.json"
+_manifests_lock = threading.Lock()
+_manifests: Dict[Path, "DownloadManifest"] = {}
+
 
 def register_status_callback(callback: Callable[[str, Dict[str, object]], None]) -> None:
     """Register a callback to receive live crawler status messages."""
@@ -51,11 +133,31 @@ def register_status_callback(callback: Callable[[str, Dict[str, object]], None])
 
 
 def _emit_status(message: str, *, context: Optional[Dict[str, object]] = None) -> None:
-    """Print a status message and forward it to registered subscribers."""
+    """
+    Print a status message and forward it to registered subscribers.
+
+    Only messages emitted with a context are forwarded; detail lines without
+    one (URLs, separators, per-file results) are just printed. Forwarding is
+    throttled to one update per STATUS_THROTTLE_SECONDS. Context from skipped
+    updates is merged into the next one sent, and terminal states are always
+    delivered.
+    """
+    global _last_status_sent
 
     print(message)
+    if context is None:
+        return
+
+    with _status_lock:
+        _pending_status_context.update(context)
+        now = time.monotonic()
+        is_terminal = _pending_status_context.get("state") in _TERMINAL_STATES
+        if not is_terminal and now - _last_status_sent < STATUS_THROTTLE_SECONDS:
+            return
+        _last_status_sent = now
+        extra = dict(_pending_status_context)
+        _pending_status_context.clear()
 
-    extra = context or {}
     for callback in _STATUS_SUBSCRIBERS:
         try:
             callback(message, extra)
@@ -63,331 +165,447 @@ def _emit_status(message: str, *, context: Optional[Dict[str, object]] = None) -
             logger.exception("Status callback failed")
 
 
+def _reset_status_throttle() -> None:
+    """Forget throttled context and the last send time, so the next crawl starts clean."""
+    global _last_status_sent
+
+    with _status_lock:
+        _last_status_sent = 0.0
+        _pending_status_context.clear()
+
+
+class UrlSieve:
+    """
+    Set of URLs already seen by the crawler, stored as 64-bit fingerprints.
+
+    Keeping a BLAKE2 digest per URL instead of the URL string cuts memory per
+    entry to a small int; the chance of a false "seen" is negligible at crawl
+    sizes well into the millions.
+    """
+
+    def __init__(self, urls: Iterable[str] = ()) -> None:
+        self._fingerprints: Set[int] = set()
+        for url in urls:
+            self.add(url)
+
+    @staticmethod
+    def _fingerprint(url: str) -> int:
+        return int.from_bytes(hashlib.blake2s(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+    def add(self, url: str) -> bool:
+        """Record url, returning True if it had not been seen before."""
+        fingerprint = self._fingerprint(url)
+        if fingerprint in self._fingerprints:
+            return False
+        self._fingerprints.add(fingerprint)
+        return True
+
+    def __contains__(self, url: object) -> bool:
+        return isinstance(url, str) and self._fingerprint(url) in self._fingerprints
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+
+class DownloadManifest:
+    """
+    Source URL and ETag of each PDF downloaded into a folder.
+
+    One JSON file per folder maps file names to ``{"url": ..., "etag": ...}``.
+    Re-crawls use it to find a URL's earlier download, whatever name it was
+    saved under, and revalidate it instead of fetching it again. Changes stay
+    in memory until save().
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self.path = folder / MANIFEST_NAME
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, str]] = {}
+        self._names_by_url: Dict[str, str] = {}
+        self._dirty = False
+
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        if isinstance(data, dict):
+            for name, entry in data.items():
+                if isinstance(entry, dict) and entry.get("url"):
+                    self._entries[name] = entry
+                    self._names_by_url[entry["url"]] = name
+
+    def url_for(self, name: str) -> Optional[str]:
+        """Return the URL the file called name was downloaded from."""
+        entry = self._entries.get(name)
+        return entry["url"] if entry else None
+
+    def etag_for(self, name: str) -> str:
+        """Return the ETag the server sent for the file called name, if any."""
+        entry = self._entries.get(name)
+        return entry.get("etag", "") if entry else ""
+
+    def name_for(self, url: str) -> Optional[str]:
+        """Return the name of the file last downloaded from url."""
+        return self._names_by_url.get(url)
+
+    def record(self, name: str, url: str, etag: str = "") -> None:
+        """Record that the file called name now holds the download of url."""
+        with self._lock:
+            previous_name = self._names_by_url.get(url)
+            if previous_name and previous_name != name:
+                self._entries.pop(previous_name, None)
+            previous_entry = self._entries.get(name)
+            if previous_entry and previous_entry["url"] != url:
+                self._names_by_url.pop(previous_entry["url"], None)
+            self._entries[name] = {"url": url, "etag": etag} if etag else {"url": url}
+            self._names_by_url[url] = name
+            self._dirty = True
+
+    def save(self) -> None:
+        """Write the manifest if it changed, replacing the file in one step."""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(self._entries, indent=1, sort_keys=True)
+            self._dirty = False
+
+        part_path = self.path.with_name(self.path.name + ".part")
+        try:
+            part_path.write_text(payload, encoding="utf-8")
+            os.replace(part_path, self.path)
+        except OSError as exc:
+            logger.warning("Unable to save download manifest %s: %s", self.path, exc)
+            part_path.unlink(missing_ok=True)
+
+
+def _manifest_for(folder: Path) -> DownloadManifest:
+    """Return the manifest of a download folder, loading it on first use."""
+    with _manifests_lock:
+        manifest = _manifests.get(folder)
+        if manifest is None:
+            manifest = _manifests[folder] = DownloadManifest(folder)
+        return manifest
+
+
+def _reload_manifest(folder: Path) -> DownloadManifest:
+    """Load a download folder's manifest from disk, dropping any cached copy."""
+    with _manifests_lock:
+        manifest = _manifests[folder] = DownloadManifest(folder)
+        return manifest
+
+
 def crawl_and_download(
     start_url: str,
     download_folder: Path,
-    retries: int = 3,
-    delay: int = 5,
+    retries: int = HTTP_RETRIES,
+    delay: float = HTTP_RETRY_DELAY,
     *,
     allowed_hosts: Optional[Iterable[str]] = None,
     max_pages: Optional[int] = None,
     max_pdfs: Optional[int] = None,
     progress_callback: Optional[Callable[[str, Dict[str, object]], None]] = None,
-) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+) -> Tuple[List[Dict[str, object]], Dict[str, str]]:
     """
     Crawl website and download PDFs.
     
     Supports TWO watermark methods:
     1. JavaScript onclick: onclick="downloadWithWatermark('pdf/file.pdf')"
     2. Direct href: href="watermark11/download.php?show=Document Name"
+
+    Each downloaded document dict carries the DownloadedDocument column names
+    (pdf_url, source_page, filename, stored_path, file_size_bytes,
+    downloaded_at, download_method, sha256) alongside the original url, path
+    and method keys, so callers can build model rows without extra lookups.
+
+    retries and delay set the retry policy for page fetches (see
+    _retrying_session); PDF downloads use the CRAWLER_HTTP_RETRIES and
+    CRAWLER_HTTP_RETRY_DELAY defaults.
     """
 
     download_folder = Path(download_folder)
     download_folder.mkdir(parents=True, exist_ok=True)
+    manifest = _reload_manifest(download_folder)
 
-    visited: Set[str] = set()
+    # URLs are marked seen when queued, so each URL is enqueued at most once
+    seen = UrlSieve([start_url])
     queue: deque[str] = deque([start_url])
-    downloaded: List[Dict[str, str]] = []
+    downloaded: List[Dict[str, object]] = []
     downloaded_urls: Set[str] = set()
-    allowed: Optional[Set[str]] = None
+    allowed: Optional[FrozenSet[str]] = None
     started_at = datetime.utcnow()
     
     if allowed_hosts:
-        allowed = set()
+        # Store both host:port and bare host forms so most links match on netloc alone
+        normalized: Set[str] = set()
         for host in allowed_hosts:
-            lowered = host.lower()
-            allowed.add(lowered)
+            lowered = _normalize_host(host)
+            normalized.add(lowered)
             if ":" in lowered:
-                allowed.add(lowered.split(":", 1)[0])
+                normalized.add(lowered.split(":", 1)[0])
+        allowed = frozenset(normalized)
 
     pages_crawled = 0
 
     if progress_callback:
         register_status_callback(progress_callback)
 
-    _emit_status(f"\n{'='*80}")
-    _emit_status("🚀 PDF Crawler Started", context={"state": "Running", "website": start_url})
-    _emit_status(f"   Target: {start_url}")
-    _emit_status(f"   Output: {download_folder}")
-    _emit_status(f"{'='*80}\n")
-    
-    max_pdf_limit_hit = False
-
-    while queue and not max_pdf_limit_hit:
-        if max_pages is not None and pages_crawled >= max_pages:
-            logger.info("Reached maximum page limit of %s", max_pages)
-            break
+    try:
+        _emit_status(f"\n{'='*80}")
+        _emit_status("🚀 PDF Crawler Started", context={"state": "Running", "website": start_url})
+        _emit_status(f"   Target: {start_url}")
+        _emit_status(f"   Output: {download_folder}")
+        _emit_status(f"{'='*80}\n")
+    
+        max_pdf_limit_hit = False
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            while queue and not max_pdf_limit_hit:
+                if max_pages is not None and pages_crawled >= max_pages:
+                    logger.info("Reached maximum page limit of %s", max_pages)
+                    break
 
-        current_url = queue.popleft()
-        if current_url in visited:
-            continue
+                current_url = queue.popleft()
+                pages_crawled += 1
         
-        visited.add(current_url)
-        pages_crawled += 1
-        
-        _emit_status(
-            f"\n[Page {pages_crawled}] 🔍 Crawling: {current_url}",
-            context={"pages_crawled": pages_crawled, "state": "Running", "website": start_url},
-        )
+                _emit_status(
+                    f"\n[Page {pages_crawled}] 🔍 Crawling: {current_url}",
+                    context={"pages_crawled": pages_crawled, "state": "Running", "website": start_url},
+                )
 
-        response = _request_with_retries(current_url, retries=retries, delay=delay)
-        if response is None:
-            continue
+                response = _request_with_retries(current_url, retries=retries, delay=delay)
+                if response is None:
+                    continue
 
-        if not _is_html_response(response):
-            continue
+                if not _is_html_response(response):
+                    continue
 
-        try:
-            soup = BeautifulSoup(response.text, "html.parser")
-        except Exception as exc:
-            logger.warning("Skipping %s: unable to parse HTML (%s)", current_url, exc)
-            continue
+                try:
+                    soup = _parse_html(response.content, _declared_charset(response))
+                except Exception as exc:
+                    logger.warning("Skipping %s: unable to parse HTML (%s)", current_url, exc)
+                    continue
 
-        # METHOD 1: JavaScript onclick with PDF path (dgis.army.mil)
-        onclick_pdfs = _extract_onclick_pdfs(soup, current_url)
-        
-        # METHOD 2: Direct watermark href (sigweb.army.mil)
-        watermark_hrefs = _extract_watermark_hrefs(soup, current_url)
+                # METHOD 1: JavaScript onclick with PDF path (dgis.army.mil)
+                # METHOD 2: Direct watermark href (sigweb.army.mil)
+                # METHOD 3: Regular PDF links
+                onclick_pdfs, watermark_hrefs, regular_pdfs, nav_links = _extract_all(soup, current_url)
         
-        # METHOD 3: Regular PDF links
-        regular_pdfs = _extract_regular_pdf_links(soup, current_url)
-        
-        total_found = len(onclick_pdfs) + len(watermark_hrefs) + len(regular_pdfs)
-        _emit_status(
-            (
-                "   📄 Found "
-                f"{total_found} PDFs ({len(onclick_pdfs)} onclick, {len(watermark_hrefs)} watermark, {len(regular_pdfs)} direct)"
-            ),
-            context={
-                "pages_crawled": pages_crawled,
-                "downloaded": len(downloaded),
-                "state": "Running",
-                "website": start_url,
-            },
-        )
+                total_found = len(onclick_pdfs) + len(watermark_hrefs) + len(regular_pdfs)
+                _emit_status(
+                    (
+                        "   📄 Found "
+                        f"{total_found} PDFs ({len(onclick_pdfs)} onclick, {len(watermark_hrefs)} watermark, {len(regular_pdfs)} direct)"
+                    ),
+                    context={
+                        "pages_crawled": pages_crawled,
+                        "downloaded": len(downloaded),
+                        "state": "Running",
+                        "website": start_url,
+                    },
+                )
         
-        # Download onclick PDFs (Method 1)
-        for pdf_path in onclick_pdfs:
-            if pdf_path in downloaded_urls:
-                continue
-
-            pdf_info = download_onclick_watermark(pdf_path, download_folder, current_url)
-
-            if pdf_info:
-                pdf_info["source_page"] = current_url
-                pdf_info["method"] = "onclick"
-                downloaded.append(pdf_info)
-                downloaded_urls.add(pdf_path)
-
-                if max_pdfs is not None and len(downloaded) >= max_pdfs:
-                    logger.info("Reached maximum PDF limit of %s", max_pdfs)
-                    max_pdf_limit_hit = True
-                    break
-
-        if max_pdf_limit_hit:
-            break
-
-        # Download watermark hrefs (Method 2)
-        for watermark_url in watermark_hrefs:
-            if watermark_url in downloaded_urls:
-                continue
-            
-            pdf_info = download_watermark_href(watermark_url, download_folder, current_url)
-            
-            if pdf_info:
-                pdf_info["source_page"] = current_url
-                pdf_info["method"] = "watermark_href"
-                downloaded.append(pdf_info)
-                downloaded_urls.add(watermark_url)
-
-                if max_pdfs is not None and len(downloaded) >= max_pdfs:
-                    logger.info("Reached maximum PDF limit of %s", max_pdfs)
-                    max_pdf_limit_hit = True
+                # Download onclick PDFs (Method 1), watermark hrefs (Method 2) and
+                # regular PDFs (Method 3) concurrently, one batch per page
+                jobs: List[Tuple[str, str, Callable[[str, Path, str], Optional[Dict[str, object]]]]] = []
+                batch_urls: Set[str] = set()
+                for method, urls, download_fn in (
+                    ("onclick", onclick_pdfs, download_onclick_watermark),
+                    ("watermark_href", watermark_hrefs, download_watermark_href),
+                    ("direct", regular_pdfs, download_direct_pdf),
+                ):
+                    for url in urls:
+                        if url in downloaded_urls or url in batch_urls:
+                            continue
+                        if method == "direct" and allowed and not _is_allowed_host(urlsplit(url), allowed):
+                            continue
+                        jobs.append((method, url, download_fn))
+                        batch_urls.add(url)
+
+                # Never run more downloads than PDFs still allowed: a started download cannot
+                # be cancelled, so this is what keeps max_pdfs from being overshot
+                waiting = deque(jobs)
+                running: Dict[Future, Tuple[str, str]] = {}
+                while waiting or running:
+                    capacity = len(waiting) if max_pdfs is None else max_pdfs - len(downloaded) - len(running)
+                    while waiting and capacity > 0:
+                        method, url, download_fn = waiting.popleft()
+                        running[executor.submit(download_fn, url, download_folder, current_url)] = (method, url)
+                        capacity -= 1
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        method, url = running.pop(future)
+                        pdf_info = future.result()
+                        if not pdf_info:
+                            continue
+
+                        pdf_info["source_page"] = current_url
+                        pdf_info["method"] = method
+                        pdf_info["download_method"] = method
+                        downloaded.append(pdf_info)
+                        downloaded_urls.add(url)
+
+                    if max_pdfs is not None and len(downloaded) >= max_pdfs:
+                        logger.info("Reached maximum PDF limit of %s", max_pdfs)
+                        max_pdf_limit_hit = True
+                        break
+
+                manifest.save()
+
+                if max_pdf_limit_hit:
                     break
 
-        if max_pdf_limit_hit:
-            break
-
-        # Download regular PDFs (Method 3)
-        for pdf_url in regular_pdfs:
-            parsed_pdf = urlparse(pdf_url)
-            if allowed and not _is_allowed_host(parsed_pdf, allowed):
-                continue
-
-            if pdf_url in downloaded_urls:
-                continue
-
-            pdf_info = download_direct_pdf(pdf_url, download_folder, current_url)
-            if pdf_info:
-                pdf_info["source_page"] = current_url
-                pdf_info["method"] = "direct"
-                downloaded.append(pdf_info)
-                downloaded_urls.add(pdf_url)
-
-                if max_pdfs is not None and len(downloaded) >= max_pdfs:
-                    logger.info("Reached maximum PDF limit of %s", max_pdfs)
-                    max_pdf_limit_hit = True
-                    break
+                # Queue new links for crawling
+                if not max_pdf_limit_hit:
+                    links_found = 0
+                    for full_url in nav_links:
+                        parsed = urlsplit(full_url)
 
-        if max_pdf_limit_hit:
-            break
+                        if parsed.scheme not in {"http", "https"}:
+                            continue
 
-        # Queue new links for crawling
-        if not max_pdf_limit_hit:
-            links_found = 0
-            for link in soup.select("a[href]"):
-                href = link.get("href")
-                if not href:
-                    continue
+                        if allowed and not _is_allowed_host(parsed, allowed):
+                            continue
 
-                href, _ = urldefrag(href)
-                if not href or href == "#":
-                    continue
+                        path_lower = parsed.path.lower()
 
-                full_url = urljoin(current_url, href)
-                parsed = urlparse(full_url)
+                        # Skip direct PDF links (handled separately) and non-content files
+                        if path_lower.endswith(SKIP_EXTENSIONS):
+                            continue
 
-                if parsed.scheme not in {"http", "https"}:
-                    continue
+                        # Skip watermark download URLs (handled separately)
+                        if 'watermark' in path_lower and 'download.php' in path_lower:
+                            continue
 
-                if allowed and not _is_allowed_host(parsed, allowed):
-                    continue
+                        if seen.add(full_url):
+                            queue.append(full_url)
+                            links_found += 1
 
-                # Skip direct PDF links (handled separately)
-                if parsed.path.lower().endswith(".pdf"):
-                    continue
+                    if links_found > 0:
+                        _emit_status(
+                            f"   🔗 Queued {links_found} new links (Total in queue: {len(queue)})",
+                            context={
+                                "pages_crawled": pages_crawled,
+                                "downloaded": len(downloaded),
+                                "state": "Running",
+                                "website": start_url,
+                            },
+                        )
 
-                # Skip watermark download URLs (handled separately)
-                if 'watermark' in parsed.path.lower() and 'download.php' in parsed.path.lower():
-                    continue
+        _emit_status(f"\n{'='*80}")
+        _emit_status(
+            "✅ Crawling Complete!",
+            context={
+                "state": "Completed",
+                "pages_crawled": pages_crawled,
+                "downloaded": len(downloaded),
+                "website": start_url,
+            },
+        )
+        _emit_status(f"   Pages crawled: {pages_crawled}")
+        _emit_status(f"   PDFs downloaded: {len(downloaded)}")
+        _emit_status(f"   Saved to: {download_folder}")
+        _emit_status(f"{'='*80}\n")
 
-                # Skip non-content files
-                skip_ext = {'.jpg', '.jpeg', '.png', '.gif', '.css', '.js', '.ico', '.svg', '.woff', '.ttf', '.mp4', '.mp3'}
-                if any(parsed.path.lower().endswith(ext) for ext in skip_ext):
-                    continue
+        finished_at = datetime.utcnow()
 
-                if full_url not in visited and full_url not in queue:
-                    queue.append(full_url)
-                    links_found += 1
+        metadata: Dict[str, str] = {
+            "pages_crawled": str(pages_crawled),
+            "started_at": started_at.isoformat() + "Z",
+            "finished_at": finished_at.isoformat() + "Z",
+        }
 
-            if links_found > 0:
-                _emit_status(
-                    f"   🔗 Queued {links_found} new links (Total in queue: {len(queue)})",
-                    context={
-                        "pages_crawled": pages_crawled,
-                        "downloaded": len(downloaded),
-                        "state": "Running",
-                        "website": start_url,
-                    },
-                )
+        return downloaded, metadata
+    finally:
+        # Also on errors (future.result() re-raises a failed download), so later crawls
+        # never report into this run
+        if progress_callback and progress_callback in _STATUS_SUBSCRIBERS:
+            _STATUS_SUBSCRIBERS.remove(progress_callback)
+        _reset_status_throttle()
 
-    _emit_status(f"\n{'='*80}")
-    _emit_status(
-        "✅ Crawling Complete!",
-        context={
-            "state": "Completed",
-            "pages_crawled": pages_crawled,
-            "downloaded": len(downloaded),
-            "website": start_url,
-        },
-    )
-    _emit_status(f"   Pages crawled: {pages_crawled}")
-    _emit_status(f"   PDFs downloaded: {len(downloaded)}")
-    _emit_status(f"   Saved to: {download_folder}")
-    _emit_status(f"{'='*80}\n")
 
-    finished_at = datetime.utcnow()
+def _parse_html(content: bytes, encoding: Optional[str] = None) -> BeautifulSoup:
+    """Parse HTML with lxml, falling back to the stdlib parser when lxml is unavailable."""
+    try:
+        return BeautifulSoup(content, "lxml", from_encoding=encoding)
+    except bs4.FeatureNotFound:
+        return BeautifulSoup(content, "html.parser", from_encoding=encoding)
 
-    metadata: Dict[str, str] = {
-        "pages_crawled": str(pages_crawled),
-        "started_at": started_at.isoformat() + "Z",
-        "finished_at": finished_at.isoformat() + "Z",
-    }
 
-    if progress_callback and progress_callback in _STATUS_SUBSCRIBERS:
-        _STATUS_SUBSCRIBERS.remove(progress_callback)
+def _declared_charset(response: requests.Response) -> Optional[str]:
+    """
+    Return the charset named in the Content-Type header, if any.
 
-    return downloaded, metadata
+    Unlike response.encoding this does not fall back to ISO-8859-1 for text/*
+    responses, so BeautifulSoup still sniffs the encoding when none is declared.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if "charset" not in content_type.lower():
+        return None
+    return requests.utils.get_encoding_from_headers(response.headers)
 
 
-def _extract_onclick_pdfs(soup: BeautifulSoup, base_url: str) -> List[str]:
+def _extract_all(soup: BeautifulSoup, base_url: str) -> Tuple[List[str], List[str], List[str], List[str]]:
     """
-    Extract PDF paths from JavaScript onclick handlers.
-    Example: onclick="downloadWithWatermark('pdf/Laptop_Policy.pdf')"
+    Classify every link on the page in a single pass over the tree.
+
+    Returns ``(onclick_pdfs, watermark_hrefs, regular_pdfs, nav_links)``:
+    - onclick_pdfs: PDF paths from JavaScript handlers,
+      e.g. onclick="downloadWithWatermark('pdf/Laptop_Policy.pdf')"
+    - watermark_hrefs: watermark download URLs,
+      e.g. href="watermark11/download.php?show=Document Name"
+    - regular_pdfs: direct PDF links
+    - nav_links: absolute, defragmented URLs of every anchor, for the crawl queue
     """
-    discovered: List[str] = []
-    seen = set()
-    
+    onclick_pdfs: List[str] = []
+    watermark_hrefs: List[str] = []
+    regular_pdfs: List[str] = []
+    nav_links: List[str] = []
+    seen_onclick = set()
+    seen_watermark = set()
+    seen_regular = set()
+
     for element in soup.find_all(attrs={"onclick": True}):
         onclick = element.get("onclick", "")
-        if not onclick:
+        # Every match contains ".pdf", so skip the regex for handlers without it
+        if not onclick or 'pdf' not in onclick.lower():
             continue
-            
-        for match in ONCLICK_PDF_PATTERN.finditer(onclick):
-            pdf_path = match.group(1)
-            if pdf_path not in seen:
-                discovered.append(pdf_path)
-                seen.add(pdf_path)
-                logger.info("Found onclick PDF: %s", pdf_path)
-    
-    return discovered
 
+        for pdf_path in ONCLICK_PDF_PATTERN.findall(onclick):
+            if pdf_path not in seen_onclick:
+                onclick_pdfs.append(pdf_path)
+                seen_onclick.add(pdf_path)
+                logger.info("Found onclick PDF: %s", pdf_path)
 
-def _extract_watermark_hrefs(soup: BeautifulSoup, base_url: str) -> List[str]:
-    """
-    Extract watermark download URLs from href attributes.
-    
-    Examples:
-    - href="watermark11/download.php?show=Document Name"
-    - href="watermark/download.php?show=Policy"
-    """
-    discovered: List[str] = []
-    seen = set()
-    
     for link in soup.find_all('a', href=True):
-        href = link.get('href', '').strip()
+        raw_href = link.get('href', '')
+        href = raw_href.strip()
         if not href:
             continue
-        
-        # Check if this is a watermark download link
+
         href_lower = href.lower()
-        
-        # Pattern 1: watermark*/download.php
-        if 'watermark' in href_lower and 'download.php' in href_lower:
+
+        if WATERMARK_HREF_PATTERN.search(href):
             full_url = urljoin(base_url, href)
-            if full_url not in seen:
-                discovered.append(full_url)
-                seen.add(full_url)
+            if full_url not in seen_watermark:
+                watermark_hrefs.append(full_url)
+                seen_watermark.add(full_url)
                 logger.info("Found watermark href: %s", full_url)
-        
-        # Pattern 2: other watermark patterns
-        elif any(pattern in href_lower for pattern in ['getpdf', 'showpdf', 'viewpdf', 'downloadpdf']):
+
+        if href_lower.endswith('.pdf'):
             full_url = urljoin(base_url, href)
-            if full_url not in seen:
-                discovered.append(full_url)
-                seen.add(full_url)
-                logger.info("Found watermark href: %s", full_url)
-    
-    return discovered
+            if full_url not in seen_regular:
+                regular_pdfs.append(full_url)
+                seen_regular.add(full_url)
 
+        nav_href, _ = urldefrag(raw_href)
+        if nav_href and nav_href != "#":
+            nav_links.append(urljoin(base_url, nav_href))
 
-def _extract_regular_pdf_links(soup: BeautifulSoup, base_url: str) -> List[str]:
-    """Extract direct PDF links from href attributes."""
-    discovered: List[str] = []
-    seen = set()
-    
-    for link in soup.find_all('a', href=True):
-        href = link.get('href', '').strip()
-        if href.lower().endswith('.pdf'):
-            full_url = urljoin(base_url, href)
-            if full_url not in seen:
-                discovered.append(full_url)
-                seen.add(full_url)
-    
-    return discovered
+    return onclick_pdfs, watermark_hrefs, regular_pdfs, nav_links
 
 
-def download_onclick_watermark(pdf_path: str, folder: Path, base_url: str) -> Optional[Dict[str, str]]:
+def download_onclick_watermark(pdf_path: str, folder: Path, base_url: str) -> Optional[Dict[str, object]]:
     """
     Download PDF using JavaScript onclick method (dgis.army.mil style).
     
@@ -395,18 +613,7 @@ def download_onclick_watermark(pdf_path: str, folder: Path, base_url: str) -> Op
     To: https://dgis.army.mil/watermark/download.php?show=DDGIT%20Policies%2FLaptop_Policy
     """
     
-    folder.mkdir(parents=True, exist_ok=True)
-    
     pdf_name = os.path.basename(pdf_path) or "downloaded.pdf"
-    target_path = _unique_target_path(folder, pdf_name, pdf_path)
-    
-    if target_path.exists():
-        return {
-            "url": pdf_path,
-            "path": str(target_path),
-            "filename": target_path.name,
-            "downloaded_at": datetime.utcfromtimestamp(target_path.stat().st_mtime).isoformat() + "Z",
-        }
     
     # Transform path like JavaScript does
     file_name = pdf_path
@@ -417,166 +624,171 @@ def download_onclick_watermark(pdf_path: str, folder: Path, base_url: str) -> Op
     
     encoded_name = quote(file_name, safe='')
     
-    parsed_base = urlparse(base_url)
-    watermark_url = f"{parsed_base.scheme}://{parsed_base.netloc}/watermark/download.php?show={encoded_name}"
-    
-    _emit_status(
-        f"   💧 Onclick: {pdf_name}",
-        context={"state": "Running"},
-    )
-    _emit_status(f"      URL: {watermark_url}")
-    
-    response = _get_with_ssl_fallback(watermark_url, timeout=60, stream=False, referer=base_url)
-    if not response or response.status_code != 200:
-        _emit_status(f"      ✗ Failed (Status: {response.status_code if response else 'No response'})")
-        return None
+    watermark_url = f"{_url_origin(base_url)}/watermark/download.php?show={encoded_name}"
     
-    pdf_content = _extract_pdf_from_response(response.content)
-    if not pdf_content or not _is_valid_pdf(pdf_content):
-        _emit_status(f"      ✗ Invalid PDF")
-        return None
-    
-    with open(target_path, "wb") as f:
-        f.write(pdf_content)
-    
-    _emit_status(f"      ✅ Downloaded ({len(pdf_content)/1024:.1f} KB)")
-    
-    return {
-        "url": pdf_path,
-        "path": str(target_path),
-        "filename": target_path.name,
-        "downloaded_at": datetime.utcnow().isoformat() + "Z",
-    }
+    with _claimed_target_path(folder, pdf_name, pdf_path) as target_path:
+        if target_path.exists() and _is_unchanged_on_server(watermark_url, target_path, base_url):
+            return _cached_document_info(pdf_path, target_path)
+        
+        _emit_status(
+            f"   💧 Onclick: {pdf_name}",
+            context={"state": "Running"},
+        )
+        _emit_status(f"      URL: {watermark_url}")
+        
+        response = _get_with_ssl_fallback(watermark_url, timeout=60, stream=False, referer=base_url)
+        if not response or response.status_code != 200:
+            _emit_status(f"      ✗ Failed (Status: {response.status_code if response else 'No response'})")
+            return None
+        
+        pdf_content = _extract_pdf_from_response(response.content)
+        if not pdf_content or not _is_valid_pdf(pdf_content):
+            _emit_status(f"      ✗ Invalid PDF")
+            return None
+        
+        return _save_pdf(pdf_path, target_path, pdf_content, response)
 
 
-def download_watermark_href(watermark_url: str, folder: Path, referer: str) -> Optional[Dict[str, str]]:
+def download_watermark_href(watermark_url: str, folder: Path, referer: str) -> Optional[Dict[str, object]]:
     """
     Download PDF from direct watermark URL (sigweb.army.mil style).
     
     Example URL: https://sigweb.army.mil/watermark11/download.php?show=Nomination%20of%20Offrs%20on%20SODE-115%20course
     """
     
-    folder.mkdir(parents=True, exist_ok=True)
-    
     # Extract PDF name from URL
     pdf_name = _extract_pdf_name_from_url(watermark_url)
-    target_path = _unique_target_path(folder, pdf_name, watermark_url)
-    
-    if target_path.exists():
-        return {
-            "url": watermark_url,
-            "path": str(target_path),
-            "filename": target_path.name,
-            "downloaded_at": datetime.utcfromtimestamp(target_path.stat().st_mtime).isoformat() + "Z",
-        }
     
-    _emit_status(
-        f"   💧 Watermark: {pdf_name}",
-        context={"state": "Running"},
-    )
-    _emit_status(f"      URL: {watermark_url}")
-    
-    # Make request
-    response = _get_with_ssl_fallback(watermark_url, timeout=60, stream=False, referer=referer)
-    
-    if not response:
-        _emit_status(f"      ✗ No response")
-        return None
+    with _claimed_target_path(folder, pdf_name, watermark_url) as target_path:
+        if target_path.exists() and _is_unchanged_on_server(watermark_url, target_path, referer):
+            return _cached_document_info(watermark_url, target_path)
+        
+        _emit_status(
+            f"   💧 Watermark: {pdf_name}",
+            context={"state": "Running"},
+        )
+        _emit_status(f"      URL: {watermark_url}")
+        
+        # Make request
+        response = _get_with_ssl_fallback(watermark_url, timeout=60, stream=False, referer=referer)
+        
+        if not response:
+            _emit_status(f"      ✗ No response")
+            return None
 
-    if response.status_code != 200:
-        _emit_status(f"      ✗ Status {response.status_code}")
-        return None
-    
-    # Check if we got HTML error instead of PDF
-    content_type = response.headers.get('Content-Type', '').lower()
-    if 'text/html' in content_type and 'application/pdf' not in content_type:
-        _emit_status(f"      ⚠️  Got HTML instead of PDF")
-        # Try to see if it's a redirect or error page
-        if b'<html' in response.content[:200].lower():
-            _emit_status(f"      Response starts with: {response.content[:100]}")
+        if response.status_code != 200:
+            _emit_status(f"      ✗ Status {response.status_code}")
+            return None
+        
+        # Check if we got HTML error instead of PDF
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'text/html' in content_type and 'application/pdf' not in content_type:
+            _emit_status(f"      ⚠️  Got HTML instead of PDF")
+            # Try to see if it's a redirect or error page
+            if b'<html' in response.content[:200].lower():
+                _emit_status(f"      Response starts with: {response.content[:100]}")
+                return None
+        
+        # Extract PDF content
+        pdf_content = _extract_pdf_from_response(response.content)
+        
+        if not pdf_content:
+            _emit_status(f"      ✗ No PDF found in response ({len(response.content)} bytes)")
+            _emit_status(f"      First 200 bytes: {response.content[:200]}")
             return None
-    
-    # Extract PDF content
-    pdf_content = _extract_pdf_from_response(response.content)
-    
-    if not pdf_content:
-        _emit_status(f"      ✗ No PDF found in response ({len(response.content)} bytes)")
-        _emit_status(f"      First 200 bytes: {response.content[:200]}")
-        return None
 
-    if not _is_valid_pdf(pdf_content):
-        _emit_status(f"      ✗ Invalid PDF")
-        return None
-    
-    # Check for better filename in Content-Disposition header
-    content_disp = response.headers.get('Content-Disposition', '')
-    if 'filename=' in content_disp:
-        match = re.search(r'filename[^;=\n]*=(([\'"]).*?\2|[^;\n]*)', content_disp)
-        if match:
-            better_name = match.group(1).strip('\'"')
-            if better_name and better_name.endswith('.pdf'):
-                pdf_name = _sanitize_filename(better_name)
-                target_path = _unique_target_path(folder, pdf_name, watermark_url)
-    
-    # Save PDF
-    with open(target_path, "wb") as f:
-        f.write(pdf_content)
-    
-    _emit_status(f"      ✅ Downloaded ({len(pdf_content)/1024:.1f} KB)")
-    
-    return {
-        "url": watermark_url,
-        "path": str(target_path),
-        "filename": target_path.name,
-        "downloaded_at": datetime.utcnow().isoformat() + "Z",
-    }
+        if not _is_valid_pdf(pdf_content):
+            _emit_status(f"      ✗ Invalid PDF")
+            return None
+        
+        # Check for better filename in Content-Disposition header
+        content_disp = response.headers.get('Content-Disposition', '')
+        if 'filename=' in content_disp:
+            match = re.search(r'filename[^;=\n]*=(([\'"]).*?\2|[^;\n]*)', content_disp)
+            if match:
+                better_name = match.group(1).strip('\'"')
+                if better_name and better_name.endswith('.pdf'):
+                    better_name = _sanitize_filename(better_name)
+                    # target_path already has that name when it is this URL's earlier download
+                    if better_name != target_path.name:
+                        with _claimed_target_path(folder, better_name, watermark_url) as better_path:
+                            return _save_pdf(watermark_url, better_path, pdf_content, response)
+        
+        return _save_pdf(watermark_url, target_path, pdf_content, response)
 
 
-def download_direct_pdf(pdf_url: str, folder: Path, referer: str) -> Optional[Dict[str, str]]:
+def download_direct_pdf(pdf_url: str, folder: Path, referer: str) -> Optional[Dict[str, object]]:
     """Download direct PDF link."""
     
-    folder.mkdir(parents=True, exist_ok=True)
-    
-    parsed = urlparse(pdf_url)
+    parsed = urlsplit(pdf_url)
     pdf_name = os.path.basename(parsed.path) or "downloaded.pdf"
-    target_path = _unique_target_path(folder, pdf_name, pdf_url)
-    
-    if target_path.exists():
-        return {
-            "url": pdf_url,
-            "path": str(target_path),
-            "filename": target_path.name,
-            "downloaded_at": datetime.utcfromtimestamp(target_path.stat().st_mtime).isoformat() + "Z",
-        }
-    
-    _emit_status(
-        f"   📄 Direct: {pdf_name}",
-        context={"state": "Running"},
-    )
-    
-    response = _get_with_ssl_fallback(pdf_url, timeout=30, stream=False, referer=referer)
-    if not response or response.status_code != 200:
-        _emit_status(f"      ✗ Failed")
-        return None
-    
-    pdf_content = _extract_pdf_from_response(response.content)
-    if not pdf_content or not _is_valid_pdf(pdf_content):
-        _emit_status(f"      ✗ Invalid")
-        return None
     
+    with _claimed_target_path(folder, pdf_name, pdf_url) as target_path:
+        if target_path.exists() and _is_unchanged_on_server(pdf_url, target_path, referer):
+            return _cached_document_info(pdf_url, target_path)
+        
+        _emit_status(
+            f"   📄 Direct: {pdf_name}",
+            context={"state": "Running"},
+        )
+        
+        response = _get_with_ssl_fallback(pdf_url, timeout=30, stream=True, referer=referer)
+        if not response or response.status_code != 200:
+            if response is not None:
+                response.close()
+            _emit_status(f"      ✗ Failed")
+            return None
+        
+        streamed = _stream_pdf_to_file(response, target_path)
+        if streamed is None:
+            _emit_status(f"      ✗ Invalid")
+            return None
+        size, sha256 = streamed
+        _record_download(target_path, pdf_url, response)
+        
+        _emit_status(f"      ✅ Downloaded ({size/1024:.1f} KB)")
+        
+        return _document_info(pdf_url, target_path, size, sha256)
+
+
+def _save_pdf(url: str, target_path: Path, pdf_content: bytes, response: requests.Response) -> Dict[str, object]:
+    """Write an in-memory PDF body to target_path and build its result dict."""
     with open(target_path, "wb") as f:
         f.write(pdf_content)
+    _record_download(target_path, url, response)
     
     _emit_status(f"      ✅ Downloaded ({len(pdf_content)/1024:.1f} KB)")
     
+    return _document_info(url, target_path, len(pdf_content), hashlib.sha256(pdf_content).hexdigest())
+
+
+def _document_info(
+    url: str,
+    target_path: Path,
+    size_bytes: Optional[int],
+    sha256: str = "",
+    downloaded_at: Optional[datetime] = None,
+) -> Dict[str, object]:
+    """Build the result dict for a downloaded PDF."""
+    downloaded_at = downloaded_at or datetime.utcnow()
     return {
-        "url": pdf_url,
+        "url": url,
         "path": str(target_path),
         "filename": target_path.name,
-        "downloaded_at": datetime.utcnow().isoformat() + "Z",
+        "downloaded_at": downloaded_at.isoformat() + "Z",
+        "pdf_url": url,
+        "stored_path": str(target_path),
+        "file_size_bytes": size_bytes,
+        "sha256": sha256,
     }
 
 
+def _cached_document_info(url: str, target_path: Path) -> Dict[str, object]:
+    """Build the result dict for a PDF already present on disk."""
+    stat = target_path.stat()
+    return _document_info(url, target_path, stat.st_size, downloaded_at=datetime.utcfromtimestamp(stat.st_mtime))
+
+
 def _extract_pdf_name_from_url(url: str) -> str:
     """
     Extract PDF name from watermark URL.
@@ -588,7 +800,7 @@ def _extract_pdf_name_from_url(url: str) -> str:
     - watermark/download.php?show=Policy Document
       → Policy_Document.pdf
     """
-    parsed = urlparse(url)
+    parsed = urlsplit(url)
     
     # Try to parse query parameters
     try:
@@ -619,7 +831,7 @@ def _extract_pdf_name_from_url(url: str) -> str:
         logger.debug("Error parsing query params: %s", e)
     
     # Fallback: use hash of URL
-    url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+    url_hash = hashlib.blake2s(url.encode("utf-8"), digest_size=4).hexdigest()
     return f"watermark_{url_hash}.pdf"
 
 
@@ -632,9 +844,8 @@ def _sanitize_filename(name: str) -> str:
     if name.lower().endswith('.pdf'):
         name = name[:-4]
     
-    # Replace problematic characters with underscore
-    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '_', name)
-    name = name.replace('\n', '_').replace('\r', '_').replace('\t', '_')
+    # Replace problematic characters (including control characters) with underscore
+    name = name.translate(_UNSAFE_FILENAME_CHARS)
     
     # Replace multiple spaces/underscores with single underscore
     name = re.sub(r'[ _]+', '_', name)
@@ -657,10 +868,25 @@ def _sanitize_filename(name: str) -> str:
     return name
 
 
-def _is_allowed_host(parsed: ParseResult, allowed: Set[str]) -> bool:
-    netloc = parsed.netloc.lower()
-    hostname = parsed.hostname.lower() if parsed.hostname else ""
-    return netloc in allowed or hostname in allowed
+@lru_cache(maxsize=4096)
+def _normalize_host(netloc: str) -> str:
+    """Lowercase a netloc; a crawl sees the same few hosts thousands of times."""
+    return netloc.lower()
+
+
+@lru_cache(maxsize=4096)
+def _url_origin(url: str) -> str:
+    """Return the scheme://netloc prefix of url."""
+    parsed = urlsplit(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _is_allowed_host(parsed: SplitResult, allowed: FrozenSet[str]) -> bool:
+    if _normalize_host(parsed.netloc) in allowed:
+        return True
+    # hostname is already lowercased by urllib and drops any port or credentials
+    hostname = parsed.hostname
+    return bool(hostname) and hostname in allowed
 
 
 def _iter_attribute_strings(value: object) -> Iterator[str]:
@@ -677,34 +903,102 @@ def _iter_attribute_strings(value: object) -> Iterator[str]:
     yield str(value)
 
 
-def _get_with_ssl_fallback(url: str, *, timeout: int, stream: bool = False, referer: Optional[str] = None) -> Optional[requests.Response]:
+def _get_with_ssl_fallback(
+    url: str,
+    *,
+    timeout: int,
+    stream: bool = False,
+    referer: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+) -> Optional[requests.Response]:
     """Perform GET request with SSL fallback."""
-    headers = {}
+    return _request_with_ssl_fallback("GET", url, timeout=timeout, stream=stream, referer=referer, session=session)
+
+
+def _request_with_ssl_fallback(
+    method: str,
+    url: str,
+    *,
+    timeout: int,
+    stream: bool = False,
+    referer: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    session: Optional[requests.Session] = None,
+) -> Optional[requests.Response]:
+    """Perform an HTTP request, retrying without certificate verification on SSL errors."""
+    session = session or _SESSION
+    headers = dict(headers or {})
     if referer:
         headers["Referer"] = referer
     
     try:
-        return _SESSION.get(url, timeout=timeout, stream=stream, headers=headers)
+        return session.request(method, url, timeout=timeout, stream=stream, headers=headers, allow_redirects=True)
     except requests.exceptions.SSLError:
         if not VERIFY_SSL:
             return None
         try:
-            return _SESSION.get(url, timeout=timeout, stream=stream, verify=False, headers=headers)
+            return session.request(
+                method, url, timeout=timeout, stream=stream, verify=False, headers=headers, allow_redirects=True
+            )
         except:
             return None
     except:
         return None
 
 
-def _request_with_retries(url: str, retries: int = 3, delay: int = 5, referer: Optional[str] = None) -> Optional[requests.Response]:
-    """Fetch URL with retries."""
-    for attempt in range(retries):
-        response = _get_with_ssl_fallback(url, timeout=15, referer=referer)
-        if response and response.status_code == 200:
-            return response
-        if attempt < retries - 1:
-            time.sleep(delay)
-    return None
+def _record_download(target_path: Path, url: str, response: requests.Response) -> None:
+    """Record the source URL and ETag of a downloaded PDF in its folder's manifest."""
+    _manifest_for(target_path.parent).record(target_path.name, url, response.headers.get("ETag", ""))
+
+
+def _is_unchanged_on_server(url: str, target_path: Path, referer: Optional[str] = None) -> bool:
+    """
+    Check whether an already downloaded PDF is still current on the server.
+
+    Sends a conditional HEAD built from the file's mtime and stored ETag. The
+    local copy is kept on 304, a matching ETag or Content-Length, or when the
+    server gives no usable answer; only a definite mismatch forces a re-download.
+    """
+    stat = target_path.stat()
+    headers = {"If-Modified-Since": formatdate(stat.st_mtime, usegmt=True)}
+    stored_etag = _manifest_for(target_path.parent).etag_for(target_path.name)
+    if stored_etag:
+        headers["If-None-Match"] = stored_etag
+
+    response = _request_with_ssl_fallback("HEAD", url, timeout=10, referer=referer, headers=headers)
+    if response is None or response.status_code != 200:
+        return True
+
+    etag = response.headers.get("ETag")
+    if stored_etag and etag:
+        return etag == stored_etag
+
+    # Content-Length is only comparable to the file size for uncompressed bodies
+    content_length = response.headers.get("Content-Length")
+    if content_length and not response.headers.get("Content-Encoding"):
+        return content_length == str(stat.st_size)
+
+    return True
+
+
+def _request_with_retries(
+    url: str,
+    retries: int = HTTP_RETRIES,
+    delay: float = HTTP_RETRY_DELAY,
+    referer: Optional[str] = None,
+) -> Optional[requests.Response]:
+    """
+    Fetch a page, returning None unless it answered 200.
+
+    Connection failures and transient 5xx responses are retried with backoff
+    by the urllib3 Retry of _retrying_session(retries, delay), so by the time
+    this sees a failure it is final.
+    """
+    session = _retrying_session(retries, delay)
+    response = _get_with_ssl_fallback(url, timeout=15, referer=referer, session=session)
+    if response is None or response.status_code != 200:
+        return None
+    return response
 
 
 def _is_html_response(response: requests.Response) -> bool:
@@ -713,14 +1007,37 @@ def _is_html_response(response: requests.Response) -> bool:
     return "html" in content_type or "xml" in content_type or content_type.startswith("text/")
 
 
-def _unique_target_path(folder: Path, pdf_name: str, url: str) -> Path:
-    """Generate unique file path."""
-    candidate = folder / pdf_name
-    if not candidate.exists():
-        return candidate
-    
+@contextmanager
+def _claimed_target_path(folder: Path, pdf_name: str, url: str) -> Iterator[Path]:
+    """
+    Reserve a unique file path for url while it is being downloaded.
+
+    A file the manifest records as this URL's earlier download is reused under
+    whatever name it was saved, so re-crawls revalidate it. Otherwise the plain
+    name is used when it is free; if another URL's file or in-flight download
+    has it, a URL-hashed name is used. The choice is made under a lock, so
+    parallel downloads of same-named PDFs never share a file or its .part file.
+    """
+    manifest = _manifest_for(folder)
+    with _target_path_lock:
+        previous_name = manifest.name_for(url)
+        candidate = folder / previous_name if previous_name else None
+        if candidate is None or candidate in _claimed_target_paths or not candidate.exists():
+            candidate = folder / pdf_name
+            if candidate in _claimed_target_paths or (candidate.exists() and manifest.url_for(pdf_name) != url):
+                candidate = _hashed_target_path(folder, pdf_name, url)
+        _claimed_target_paths.add(candidate)
+    try:
+        yield candidate
+    finally:
+        with _target_path_lock:
+            _claimed_target_paths.discard(candidate)
+
+
+def _hashed_target_path(folder: Path, pdf_name: str, url: str) -> Path:
+    """Return the URL-specific fallback path used when pdf_name is taken."""
     stem, suffix = os.path.splitext(pdf_name)
-    hashed = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    hashed = hashlib.blake2s(url.encode("utf-8"), digest_size=5).hexdigest()
     return folder / f"{stem}_{hashed}{suffix or '.pdf'}"
 
 
@@ -728,7 +1045,67 @@ def _is_valid_pdf(content: bytes) -> bool:
     """Validate PDF content."""
     if not content or len(content) < 5:
         return False
-    return content.startswith(b'%PDF-') and b'%%EOF' in content[-1024:]
+    # Search the trailer in place instead of slicing off a copy of the tail
+    return content.startswith(b'%PDF-') and content.rfind(b'%%EOF', max(0, len(content) - 1024)) != -1
+
+
+def _stream_pdf_to_file(response: requests.Response, target_path: Path) -> Optional[Tuple[int, str]]:
+    """
+    Stream a PDF response body to disk without holding it in memory.
+
+    Debug output before the %PDF- header is stripped; the header must appear
+    within the first PDF_HEADER_SEARCH_LIMIT bytes. The
+    body is written to a .part file that only replaces target_path once the
+    %%EOF trailer is found. The SHA-256 digest is computed as chunks are
+    written. Returns (bytes written, hex digest), or None if the response is
+    not a valid PDF.
+    """
+    part_path = target_path.with_name(target_path.name + ".part")
+    try:
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        head = bytearray()
+        pdf_start = -1
+        for chunk in chunks:
+            # Only scan the newly read bytes, overlapping enough to catch a split header
+            search_from = max(0, len(head) - 4)
+            head += chunk
+            pdf_start = head.find(b'%PDF-', search_from)
+            if pdf_start != -1 or len(head) >= PDF_HEADER_SEARCH_LIMIT:
+                break
+
+        if pdf_start == -1:
+            return None
+
+        if pdf_start > 0:
+            logger.info("Stripped %d bytes of debug output", pdf_start)
+
+        digest = hashlib.sha256()
+        with open(part_path, "w+b") as f:
+            body = memoryview(head)[pdf_start:]
+            f.write(body)
+            digest.update(body)
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+
+            size = f.tell()
+            f.seek(max(0, size - 1024))
+            has_eof = b'%%EOF' in f.read()
+
+        if not has_eof:
+            part_path.unlink(missing_ok=True)
+            return None
+
+        # On Windows this fails while another process holds the old file open
+        os.replace(part_path, target_path)
+    except (OSError, requests.exceptions.RequestException) as exc:
+        logger.warning("Failed to stream %s: %s", response.url, exc)
+        part_path.unlink(missing_ok=True)
+        return None
+    finally:
+        response.close()
+
+    return size, digest.hexdigest()
 
 
 def _extract_pdf_from_response(content: bytes) -> Optional[bytes]:
@@ -745,13 +1122,14 @@ def _extract_pdf_from_response(content: bytes) -> Optional[bytes]:
     if not content:
         return None
     
-    # Find PDF header
-    pdf_start = content.find(b'%PDF-')
+    # Find PDF header; debug output never runs past the first megabyte
+    pdf_start = content.find(b'%PDF-', 0, PDF_HEADER_SEARCH_LIMIT)
     
     if pdf_start == -1:
         return None
     
-    if pdf_start > 0:
-        logger.info("Stripped %d bytes of debug output", pdf_start)
+    if pdf_start == 0:
+        return content
     
+    logger.info("Stripped %d bytes of debug output", pdf_start)
     return content[pdf_start:]
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-15 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadeddocument',
+            name='downloaded_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-15 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0002_downloadeddocument_downloaded_at_index'),
+    ]
+
+    operations = [
+        # Runs recorded before crawls were queued all finished inside their request
+        migrations.AddField(
+            model_name='crawlrun',
+            name='status',
+            field=models.CharField(default='Completed', help_text='Queued, Running, Completed or Failed', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='crawlrun',
+            name='status',
+            field=models.CharField(default='Queued', help_text='Queued, Running, Completed or Failed', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='crawlrun',
+            name='status_message',
+            field=models.TextField(blank=True, help_text='Latest progress or error message for the run'),
+        ),
+    ]
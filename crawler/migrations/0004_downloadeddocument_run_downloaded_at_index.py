@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-15 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0003_crawlrun_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='downloadeddocument',
+            index=models.Index(fields=['run', '-downloaded_at'], name='dldoc_run_dlat_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-15 04:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0004_downloadeddocument_run_downloaded_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlrun',
+            name='last_progress_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Last sign of life from the crawl worker, used to detect lost runs'),
+        ),
+    ]
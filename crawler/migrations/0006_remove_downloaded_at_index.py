@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-15 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0005_crawlrun_last_progress_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadeddocument',
+            name='downloaded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
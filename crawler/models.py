@@ -11,7 +11,12 @@ class CrawlRun(models.Model):
     max_pdfs = models.PositiveIntegerField(null=True, blank=True)
     pages_crawled = models.PositiveIntegerField(default=0)
     pdfs_downloaded = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, default="Queued", help_text="Queued, Running, Completed or Failed")
+    status_message = models.TextField(blank=True, help_text="Latest progress or error message for the run")
     started_at = models.DateTimeField(default=timezone.now)
+    last_progress_at = models.DateTimeField(
+        default=timezone.now, help_text="Last sign of life from the crawl worker, used to detect lost runs"
+    )
     completed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -38,6 +43,10 @@ class DownloadedDocument(models.Model):
 
     class Meta:
         ordering = ["-downloaded_at", "id"]
+        indexes = [
+            # Serves the per-run document listing (filter by run, newest first) without a sort
+            models.Index(fields=["run", "-downloaded_at"], name="dldoc_run_dlat_idx"),
+        ]
 
     def __str__(self) -> str:  # pragma: no cover - human readable representation
         return self.filename
@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', () => {
     initParticles();
     initTerminalEffect();
     initStatusPulse();
+    initLiveStatus();
 });
 
 // Form submission with loading state
@@ -472,6 +473,42 @@ function initStatusPulse() {
     setInterval(tick, 3200);
 }
 
+// Poll the queued crawl and show its results once it finishes
+function initLiveStatus() {
+    const panel = document.querySelector('[data-live-status-url]');
+    const stateChip = document.querySelector('[data-current-state]');
+    if (!panel || !stateChip) return;
+
+    const activeStates = ['Queued', 'Running'];
+    if (!activeStates.includes(stateChip.textContent.trim())) return;
+
+    const pagesCrawled = panel.querySelector('[data-pages-crawled]');
+    const pdfsDownloaded = panel.querySelector('[data-pdfs-downloaded]');
+    const statusNote = panel.querySelector('[data-status-note]');
+
+    const poll = () => {
+        fetch(panel.dataset.liveStatusUrl, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(status => {
+                if (!activeStates.includes(status.state)) {
+                    // Reload from the index page so the summary and documents render
+                    window.location.assign(panel.dataset.indexUrl);
+                    return;
+                }
+
+                stateChip.textContent = status.state;
+                stateChip.className = `status-chip status-${status.state.toLowerCase()}`;
+                if (pagesCrawled) pagesCrawled.textContent = status.pages_crawled;
+                if (pdfsDownloaded) pdfsDownloaded.textContent = status.downloaded;
+                if (statusNote && status.message) statusNote.textContent = status.message;
+                setTimeout(poll, 2000);
+            })
+            .catch(() => setTimeout(poll, 5000));
+    };
+
+    setTimeout(poll, 2000);
+}
+
 // Add glitch effect on logo hover
 document.addEventListener('DOMContentLoaded', () => {
     const logo = document.querySelector('.logo a');
@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .crawler import crawl_and_download  # Import the crawl logic from the crawler.py file
+from .models import CrawlRun, DownloadedDocument
+from .utils import safe_int
+
+logger = logging.getLogger(__name__)
+
+# Files at least this large are hashed through mmap rather than read into memory
+MMAP_HASH_THRESHOLD = 1024 * 1024
+
+# A standalone 64-character hex run in a file name, as used by content-addressed mirrors
+_NAME_DIGEST_PATTERN = re.compile(r"(?<![0-9a-fA-F])[0-9a-fA-F]{64}(?![0-9a-fA-F])")
+
+# Threads used to hash downloaded files after a crawl
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Crawler status subscribers are process-wide, so queued crawls run one at a time
+_CRAWL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crawl")
+
+# Run states a worker is still expected to move on from
+ACTIVE_STATES = ("Queued", "Running")
+
+
+def _parse_iso_timestamp(raw_value: Optional[str]) -> Optional[datetime]:
+    if not raw_value:
+        return None
+
+    normalized = raw_value.replace("Z", "+00:00")
+    try:
+        parsed = datetime.fromisoformat(normalized)
+    except ValueError:
+        return None
+
+    # Crawler timestamps are already UTC, so avoid allocating a converted copy
+    if parsed.tzinfo is dt_timezone.utc:
+        return parsed
+
+    offset = parsed.utcoffset()
+    if offset is None or offset == timedelta(0):
+        return parsed.replace(tzinfo=dt_timezone.utc)
+
+    return parsed.astimezone(dt_timezone.utc)
+
+
+def _collect_file_metadata(path: Path) -> Tuple[Optional[int], str]:
+    """Return the file size in bytes and SHA-256 hash for the given path.
+
+    With ``CRAWLER_TRUST_FILENAME_DIGESTS`` enabled, a 64-hex digest embedded in
+    the file name is taken as the file's SHA-256 without reading the file. That
+    is only correct when the source names files by their content hash.
+    """
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return None, ""
+
+    if getattr(settings, "CRAWLER_TRUST_FILENAME_DIGESTS", False):
+        match = _NAME_DIGEST_PATTERN.search(path.name)
+        if match:
+            return size, match.group(0).lower()
+
+    if size < MMAP_HASH_THRESHOLD:
+        # Small files are cheaper to read in one go than to map
+        sha256 = hashlib.sha256(path.read_bytes())
+    else:
+        # Hash the mapped pages directly, without copying them into Python buffers
+        with path.open("rb") as file_obj, mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            sha256 = hashlib.sha256(mapped)
+
+    return size, sha256.hexdigest()
+
+
+def _document_file_metadata(document: dict, path: Optional[Path]) -> Tuple[Optional[int], str]:
+    """Return size and SHA-256 recorded by the crawler, hashing the file only if missing."""
+    size_bytes = document.get("file_size_bytes")
+    sha256 = document.get("sha256")
+    if sha256 and size_bytes is not None:
+        return size_bytes, sha256
+    return _collect_file_metadata(path) if path else (None, "")
+
+
+def enqueue_crawl(
+    run_id: int,
+    start_url: str,
+    download_folder: str,
+    allowed_hosts: Iterable[str],
+    max_pages: Optional[int],
+    max_pdfs: Optional[int],
+) -> None:
+    """Queue a crawl for the background worker once the run row is committed.
+
+    With ``CRAWLER_TASKS_EAGER`` enabled the crawl runs inline instead, which
+    keeps tests and management scripts deterministic.
+    """
+    args = (run_id, start_url, download_folder, list(allowed_hosts), max_pages, max_pdfs)
+    if getattr(settings, "CRAWLER_TASKS_EAGER", False):
+        run_crawl(*args)
+        return
+
+    transaction.on_commit(lambda: _CRAWL_EXECUTOR.submit(_run_in_worker, *args))
+
+
+def fail_stale_runs() -> int:
+    """
+    Mark queued and running crawls whose worker is gone as failed.
+
+    The worker is a thread of the web process, so a restart loses its queue
+    and current crawl without a trace. A running crawl counts as lost once it
+    has reported no progress for ``CRAWLER_STALE_RUN_SECONDS``; a queued one
+    once it has waited that long while no crawl was making progress ahead of
+    it. Returns the number of runs marked failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, "CRAWLER_STALE_RUN_SECONDS", 1800))
+    stale = Q(status="Running", last_progress_at__lt=cutoff)
+    if not CrawlRun.objects.filter(status="Running", last_progress_at__gte=cutoff).exists():
+        stale |= Q(status="Queued", last_progress_at__lt=cutoff)
+
+    return CrawlRun.objects.filter(stale).update(
+        status="Failed",
+        status_message="The crawl worker stopped responding; start the crawl again.",
+        completed_at=now,
+    )
+
+
+def _run_in_worker(run_id: int, *args: object) -> None:
+    """Run a queued crawl with fresh database connections, like a task worker would."""
+    close_old_connections()
+    try:
+        run_crawl(run_id, *args)
+    except Exception:
+        # Nothing waits on the worker's future, so anything run_crawl could not record ends here
+        logger.exception("Crawl worker failed for run %s", run_id)
+    finally:
+        close_old_connections()
+
+
+def run_crawl(
+    run_id: int,
+    start_url: str,
+    download_folder: str,
+    allowed_hosts: Iterable[str],
+    max_pages: Optional[int],
+    max_pdfs: Optional[int],
+) -> None:
+    """Crawl a site for a queued run, then hash and persist what it downloaded."""
+    runs = CrawlRun.objects.filter(pk=run_id)
+    crawl_started_at = timezone.now()
+    runs.update(
+        status="Running",
+        started_at=crawl_started_at,
+        last_progress_at=crawl_started_at,
+        status_message="Crawling in progress…",
+    )
+
+    def progress_callback(status_message: str, status_context: dict) -> None:
+        """Mirror throttled crawler updates onto the run row for live_status."""
+        # Updates such as per-file messages carry no counters; keep the last known ones
+        updates = {"status_message": status_message.strip(), "last_progress_at": timezone.now()}
+        if "pages_crawled" in status_context:
+            updates["pages_crawled"] = safe_int(status_context["pages_crawled"])
+        if "downloaded" in status_context:
+            updates["pdfs_downloaded"] = safe_int(status_context["downloaded"])
+        runs.update(**updates)
+
+    try:
+        downloaded_documents, crawl_metadata = crawl_and_download(
+            start_url,
+            Path(download_folder),
+            allowed_hosts=set(allowed_hosts),
+            max_pages=max_pages,
+            max_pdfs=max_pdfs,
+            progress_callback=progress_callback,
+        )
+        _persist_crawl_results(run_id, downloaded_documents, crawl_metadata, crawl_started_at)
+    except Exception as exc:
+        # Hashing and database errors must fail the run too, or it would stay "Running"
+        logger.exception("Crawl run %s failed", run_id)
+        runs.update(status="Failed", status_message=str(exc), completed_at=timezone.now())
+
+
+def _persist_crawl_results(
+    run_id: int,
+    downloaded_documents: List[dict],
+    crawl_metadata: Dict[str, str],
+    crawl_started_at: datetime,
+) -> None:
+    """Hash the downloaded files, store their rows and mark the run completed."""
+    crawl_completed_at = timezone.now()
+
+    # Persist crawl summary and document metadata to the database
+    pages_crawled = safe_int(crawl_metadata.get("pages_crawled"), 0)
+    started_at = _parse_iso_timestamp(crawl_metadata.get("started_at")) or crawl_started_at
+    completed_at = _parse_iso_timestamp(crawl_metadata.get("finished_at")) or crawl_completed_at
+
+    # Hash files the crawler did not already hash, in parallel and before opening
+    # the transaction; hashlib releases the GIL on large buffers
+    document_paths = [
+        Path(document["path"]) if document.get("path") else None
+        for document in downloaded_documents
+    ]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        file_metadata = list(executor.map(_document_file_metadata, downloaded_documents, document_paths))
+
+    with transaction.atomic():
+        # One multi-row INSERT ... RETURNING on PostgreSQL; ignore_conflicts must stay
+        # off for the returned primary keys to be set on the instances
+        DownloadedDocument.objects.bulk_create(
+            [
+                DownloadedDocument(
+                    run_id=run_id,
+                    pdf_url=document.get("url", ""),
+                    source_page=document.get("source_page", ""),
+                    filename=document.get("filename") or (path_value.name if path_value else "document.pdf"),
+                    stored_path=str(path_value) if path_value else "",
+                    file_size_bytes=size_bytes,
+                    downloaded_at=_parse_iso_timestamp(document.get("downloaded_at")) or completed_at,
+                    download_method=document.get("method", ""),
+                    sha256=sha256,
+                )
+                for document, path_value, (size_bytes, sha256) in zip(
+                    downloaded_documents, document_paths, file_metadata
+                )
+            ],
+            batch_size=1000,
+            ignore_conflicts=False,
+        )
+
+        CrawlRun.objects.filter(pk=run_id).update(
+            status="Completed",
+            status_message="Crawl finished successfully.",
+            pages_crawled=pages_crawled,
+            pdfs_downloaded=len(downloaded_documents),
+            started_at=started_at,
+            completed_at=completed_at,
+        )
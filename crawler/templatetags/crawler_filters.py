@@ -0,0 +1,13 @@
+from typing import Optional
+
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def kilobytes(size_bytes: Optional[int]) -> Optional[float]:
+    """Convert a byte count into kilobytes rounded to two decimals."""
+    if size_bytes is None:
+        return None
+    return round(size_bytes / 1024, 2)
@@ -1,19 +1,24 @@
+import hashlib
+import io
 import shutil
 import tempfile
-from datetime import datetime
+import threading
+from datetime import datetime, timezone as dt_timezone
 from pathlib import Path
 from unittest import mock
 
-from django.test import TestCase, override_settings
+import requests
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
-from django.utils import timezone
 
+from .crawler import _STATUS_SUBSCRIBERS, MANIFEST_NAME, crawl_and_download
 from .models import CrawlRun, DownloadedDocument
 
 class StartScrapingViewTests(TestCase):
     def setUp(self) -> None:
         self.temp_dir = tempfile.mkdtemp(prefix="crawler-tests-")
-        self.override = override_settings(PDF_DOWNLOAD_ROOT=self.temp_dir)
+        self.override = override_settings(PDF_DOWNLOAD_ROOT=self.temp_dir, CRAWLER_TASKS_EAGER=True)
         self.override.enable()
         self.download_root = Path(self.temp_dir)
 
@@ -44,7 +49,7 @@ class StartScrapingViewTests(TestCase):
             "finished_at": "2024-06-01T12:01:00Z",
         }
 
-        with mock.patch("crawler.views.crawl_and_download", return_value=(crawl_output, crawl_metadata)):
+        with mock.patch("crawler.tasks.crawl_and_download", return_value=(crawl_output, crawl_metadata)):
             response = self.client.post(
                 reverse("start_scraping"),
                 {
@@ -52,15 +57,16 @@ class StartScrapingViewTests(TestCase):
                 },
             )
 
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
 
         self.assertEqual(CrawlRun.objects.count(), 1)
         crawl_run = CrawlRun.objects.first()
         assert crawl_run is not None
         self.assertEqual(crawl_run.start_url, "https://example.com")
+        self.assertEqual(crawl_run.status, "Completed")
         self.assertEqual(crawl_run.pages_crawled, 5)
         self.assertEqual(crawl_run.pdfs_downloaded, 1)
-        expected_start = datetime(2024, 6, 1, 11, 59, tzinfo=timezone.utc)
+        expected_start = datetime(2024, 6, 1, 11, 59, tzinfo=dt_timezone.utc)
         self.assertLess(abs((crawl_run.started_at - expected_start).total_seconds()), 1)
 
         documents = DownloadedDocument.objects.filter(run=crawl_run)
@@ -73,3 +79,333 @@ class StartScrapingViewTests(TestCase):
         self.assertEqual(document.download_method, "direct")
         self.assertEqual(document.file_size_bytes, len(pdf_content))
         self.assertEqual(len(document.sha256), 64)
+
+    def test_index_reloads_documents_from_last_run(self) -> None:
+        host_folder = self.download_root / "example.com"
+        host_folder.mkdir(parents=True, exist_ok=True)
+        pdf_path = host_folder / "example.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4 test pdf\n%%EOF")
+
+        crawl_output = [
+            {
+                "url": "https://example.com/example.pdf",
+                "path": str(pdf_path),
+                "filename": "example.pdf",
+                "downloaded_at": "2024-06-01T12:00:00Z",
+                "source_page": "https://example.com/page",
+                "method": "direct",
+            }
+        ]
+        crawl_metadata = {"pages_crawled": "1"}
+
+        with mock.patch("crawler.tasks.crawl_and_download", return_value=(crawl_output, crawl_metadata)):
+            self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        session = self.client.session
+        self.assertNotIn("documents", session["LAST_CONTEXT"])
+        self.assertEqual(session["LAST_RUN_ID"], CrawlRun.objects.get().pk)
+
+        response = self.client.get(reverse("index"))
+
+        self.assertEqual(response.status_code, 200)
+        documents = response.context["documents"]
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0]["filename"], "example.pdf")
+        self.assertEqual(documents[0]["method"], "direct")
+        self.assertEqual(documents[0]["path"], str(pdf_path))
+        self.assertContains(response, "data-table-row", count=1)
+        self.assertContains(response, "example.pdf")
+        self.assertContains(response, "https://example.com/page")
+        self.assertContains(response, '<span class="method-badge">direct</span>', html=True)
+        self.assertContains(response, str(pdf_path))
+        self.assertContains(response, "0.02 KB")
+        self.assertContains(response, "2024-06-01 12:00:00 UTC")
+
+    def test_uses_crawler_recorded_digest_without_rehashing(self) -> None:
+        pdf_path = self.download_root / "example.com" / "example.pdf"
+        crawl_output = [
+            {
+                "url": "https://example.com/example.pdf",
+                "path": str(pdf_path),
+                "filename": "example.pdf",
+                "downloaded_at": "2024-06-01T12:00:00Z",
+                "source_page": "https://example.com/page",
+                "method": "direct",
+                "file_size_bytes": 1234,
+                "sha256": "a" * 64,
+            }
+        ]
+
+        with mock.patch(
+            "crawler.tasks.crawl_and_download", return_value=(crawl_output, {"pages_crawled": "1"})
+        ), mock.patch("crawler.tasks._collect_file_metadata") as collect:
+            self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        collect.assert_not_called()
+        document = DownloadedDocument.objects.get()
+        self.assertEqual(document.file_size_bytes, 1234)
+        self.assertEqual(document.sha256, "a" * 64)
+
+    def test_queues_crawl_and_reports_live_status(self) -> None:
+        with override_settings(CRAWLER_TASKS_EAGER=False), mock.patch(
+            "crawler.tasks._CRAWL_EXECUTOR"
+        ) as crawl_executor, mock.patch("crawler.tasks.crawl_and_download") as crawl:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        self.assertEqual(response.status_code, 202)
+        crawl.assert_not_called()
+        crawl_executor.submit.assert_called_once()
+        crawl_run = CrawlRun.objects.get()
+        self.assertEqual(crawl_run.status, "Queued")
+        self.assertEqual(self.client.session["LAST_RUN_ID"], crawl_run.pk)
+
+        CrawlRun.objects.filter(pk=crawl_run.pk).update(status="Running", pages_crawled=3, pdfs_downloaded=1)
+        status = self.client.get(reverse("live_status")).json()
+
+        self.assertEqual(status["state"], "Running")
+        self.assertEqual(status["website"], "https://example.com")
+        self.assertEqual(status["pages_crawled"], 3)
+        self.assertEqual(status["downloaded"], 1)
+
+    def test_live_status_fails_runs_whose_worker_is_gone(self) -> None:
+        long_ago = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        lost = CrawlRun.objects.create(
+            start_url="https://example.com", download_directory=self.temp_dir, status="Running", last_progress_at=long_ago
+        )
+        waiting = CrawlRun.objects.create(
+            start_url="https://example.org", download_directory=self.temp_dir, status="Queued", last_progress_at=long_ago
+        )
+        session = self.client.session
+        session["LAST_RUN_ID"] = lost.pk
+        session.save()
+
+        # A queued run is not given up on while another crawl is still making progress
+        busy = CrawlRun.objects.create(start_url="https://example.net", download_directory=self.temp_dir, status="Running")
+        status = self.client.get(reverse("live_status")).json()
+
+        self.assertEqual(status["state"], "Failed")
+        self.assertIn("stopped responding", status["message"])
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, "Queued")
+
+        busy.delete()
+        session["LAST_RUN_ID"] = waiting.pk
+        session.save()
+        status = self.client.get(reverse("live_status")).json()
+
+        self.assertEqual(status["state"], "Failed")
+
+    def test_trusts_digest_in_filename_when_enabled(self) -> None:
+        digest = "AB" * 32
+        pdf_path = self.download_root / "example.com" / f"{digest}.pdf"
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+        pdf_path.write_bytes(b"%PDF-1.4 test pdf\n%%EOF")
+        crawl_output = [
+            {
+                "url": f"https://example.com/{digest}.pdf",
+                "path": str(pdf_path),
+                "filename": pdf_path.name,
+                "downloaded_at": "2024-06-01T12:00:00Z",
+                "source_page": "https://example.com/page",
+                "method": "watermark_href",
+            }
+        ]
+
+        for trusted, expected in ((False, hashlib.sha256(pdf_path.read_bytes()).hexdigest()), (True, digest.lower())):
+            with override_settings(CRAWLER_TRUST_FILENAME_DIGESTS=trusted), mock.patch(
+                "crawler.tasks.crawl_and_download", return_value=(crawl_output, {"pages_crawled": "1"})
+            ):
+                self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+            document = DownloadedDocument.objects.latest("id")
+            self.assertEqual(document.sha256, expected)
+            self.assertEqual(document.file_size_bytes, pdf_path.stat().st_size)
+
+    def test_progress_updates_without_counters_keep_the_last_counts(self) -> None:
+        observed = {}
+
+        def fake_crawl(*args, progress_callback, **kwargs):
+            progress_callback("Found 4 PDFs", {"pages_crawled": 3, "downloaded": 1, "state": "Running"})
+            progress_callback("   💧 Onclick: example.pdf", {"state": "Running"})
+            observed.update(CrawlRun.objects.values("pages_crawled", "pdfs_downloaded", "status_message").get())
+            return [], {"pages_crawled": "3"}
+
+        with mock.patch("crawler.tasks.crawl_and_download", side_effect=fake_crawl):
+            self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        self.assertEqual(
+            observed,
+            {"pages_crawled": 3, "pdfs_downloaded": 1, "status_message": "💧 Onclick: example.pdf"},
+        )
+
+    def test_marks_run_failed_when_persisting_results_raises(self) -> None:
+        crawl_output = [
+            {
+                "url": "https://example.com/example.pdf",
+                "path": str(self.download_root / "example.com" / "example.pdf"),
+                "filename": "example.pdf",
+                "method": "direct",
+            }
+        ]
+
+        with mock.patch(
+            "crawler.tasks.crawl_and_download", return_value=(crawl_output, {"pages_crawled": "1"})
+        ), mock.patch("crawler.tasks._document_file_metadata", side_effect=PermissionError("access denied")):
+            self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        crawl_run = CrawlRun.objects.get()
+        self.assertEqual(crawl_run.status, "Failed")
+        self.assertEqual(crawl_run.status_message, "access denied")
+        self.assertIsNotNone(crawl_run.completed_at)
+        self.assertFalse(DownloadedDocument.objects.exists())
+
+    def test_marks_run_failed_when_storing_documents_fails_inside_a_transaction(self) -> None:
+        # TestCase wraps each test in a transaction, as eager mode runs inside a caller's
+        crawl_output = [{"url": "https://example.com/example.pdf", "sha256": "0" * 64, "file_size_bytes": 1}]
+
+        with mock.patch(
+            "crawler.tasks.crawl_and_download", return_value=(crawl_output, {"pages_crawled": "1"})
+        ), mock.patch.object(
+            DownloadedDocument.objects, "bulk_create", side_effect=DatabaseError("insert failed")
+        ):
+            self.client.post(reverse("start_scraping"), {"url": "https://example.com"})
+
+        crawl_run = CrawlRun.objects.get()
+        self.assertEqual(crawl_run.status, "Failed")
+        self.assertEqual(crawl_run.status_message, "insert failed")
+
+
+def _fake_response(url: str, body: bytes, content_type: str = "application/pdf", status: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers["Content-Type"] = content_type
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class CrawlAndDownloadTests(SimpleTestCase):
+    start_url = "http://example.test/"
+
+    def setUp(self) -> None:
+        self.download_folder = Path(tempfile.mkdtemp(prefix="crawler-tests-"))
+        self.requests_made = []
+        self.pdf_gate = None
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.download_folder, ignore_errors=True)
+
+    def _serve(self, pdf_paths):
+        page = "".join(f'<a href="{path}">{path}</a>' for path in pdf_paths)
+
+        def fake_request(method, url, **kwargs):
+            self.requests_made.append((method, url))
+            if method == "HEAD":
+                return _fake_response(url, b"", status=304)
+            if url == self.start_url:
+                return _fake_response(url, f"<html><body>{page}</body></html>".encode(), "text/html")
+            if self.pdf_gate is not None:
+                self.pdf_gate.wait()
+            response = _fake_response(url, self._pdf_body(url))
+            if "download.php" in url:
+                response.headers["Content-Disposition"] = 'attachment; filename="Final Report.pdf"'
+            return response
+
+        return mock.patch("crawler.crawler._SESSION.request", side_effect=fake_request)
+
+    @staticmethod
+    def _pdf_body(url: str) -> bytes:
+        return f"%PDF-1.4 {url}\n%%EOF".encode()
+
+    def _crawl(self, **kwargs):
+        return crawl_and_download(self.start_url, self.download_folder, **kwargs)
+
+    def test_parallel_downloads_with_same_name_get_separate_files(self) -> None:
+        # Hold both downloads until each has picked its file, as a real race would
+        self.pdf_gate = threading.Barrier(2, timeout=5)
+        with self._serve(["/a/report.pdf", "/b/report.pdf"]):
+            documents, _ = self._crawl(max_pages=1)
+
+        self.assertEqual(len(documents), 2)
+        self.assertEqual(len({document["path"] for document in documents}), 2)
+        for document in documents:
+            self.assertEqual(Path(document["path"]).read_bytes(), self._pdf_body(document["url"]))
+        self.assertEqual(len(list(self.download_folder.glob("*.pdf"))), 2)
+
+    def test_max_pdfs_stops_downloads_at_the_limit(self) -> None:
+        with self._serve([f"/doc{index}.pdf" for index in range(6)]):
+            documents, _ = self._crawl(max_pages=1, max_pdfs=2)
+
+        self.assertEqual(len(documents), 2)
+        pdf_requests = [url for method, url in self.requests_made if url.endswith(".pdf")]
+        self.assertEqual(len(pdf_requests), 2)
+        self.assertEqual(
+            sorted(path.name for path in self.download_folder.glob("*.pdf")),
+            sorted(Path(document["path"]).name for document in documents),
+        )
+
+    def test_recrawl_revalidates_the_previous_download_in_place(self) -> None:
+        pdf_url = "http://example.test/a/report.pdf"
+        with self._serve(["/a/report.pdf"]):
+            first, _ = self._crawl(max_pages=1)
+            self.requests_made.clear()
+            second, _ = self._crawl(max_pages=1)
+
+        self.assertEqual(second[0]["path"], first[0]["path"])
+        self.assertIn(("HEAD", pdf_url), self.requests_made)
+        self.assertNotIn(("GET", pdf_url), self.requests_made)
+        self.assertEqual([path.name for path in self.download_folder.glob("*.pdf")], ["report.pdf"])
+
+    def test_recrawl_revalidates_a_watermark_download_saved_under_its_header_name(self) -> None:
+        watermark_url = "http://example.test/watermark/download.php?show=Annual%20Report"
+        with self._serve(["/watermark/download.php?show=Annual%20Report"]):
+            first, _ = self._crawl(max_pages=1)
+            self.requests_made.clear()
+            second, _ = self._crawl(max_pages=1)
+
+        self.assertEqual(Path(first[0]["path"]).name, "Final_Report.pdf")
+        self.assertEqual(second[0]["path"], first[0]["path"])
+        self.assertIn(("HEAD", watermark_url), self.requests_made)
+        self.assertNotIn(("GET", watermark_url), self.requests_made)
+        self.assertEqual(
+            sorted(path.name for path in self.download_folder.iterdir()),
+            sorted([MANIFEST_NAME, "Final_Report.pdf"]),
+        )
+
+    def test_failed_replace_drops_the_partial_file_and_keeps_crawling(self) -> None:
+        # Windows refuses to replace a file that another process has open
+        with self._serve(["/a/report.pdf"]), mock.patch(
+            "crawler.crawler.os.replace", side_effect=PermissionError("file in use")
+        ):
+            documents, metadata = self._crawl(max_pages=1)
+
+        self.assertEqual(documents, [])
+        self.assertEqual(metadata["pages_crawled"], "1")
+        self.assertEqual(list(self.download_folder.iterdir()), [])
+
+    def test_failed_crawl_unregisters_its_progress_callback(self) -> None:
+        progress_callback = mock.Mock()
+        with self._serve(["/a/report.pdf"]), mock.patch(
+            "crawler.crawler.download_direct_pdf", side_effect=RuntimeError("disk full")
+        ):
+            with self.assertRaises(RuntimeError):
+                self._crawl(max_pages=1, progress_callback=progress_callback)
+
+        self.assertNotIn(progress_callback, _STATUS_SUBSCRIBERS)
+
+    def test_next_crawl_starts_without_the_previous_crawls_status_context(self) -> None:
+        with self._serve(["/a/report.pdf"]), mock.patch(
+            "crawler.crawler.download_direct_pdf", side_effect=RuntimeError("disk full")
+        ):
+            with self.assertRaises(RuntimeError):
+                self._crawl(max_pages=1)
+
+        progress_callback = mock.Mock()
+        with self._serve([]):
+            self._crawl(max_pages=1, progress_callback=progress_callback)
+
+        # Without the reset the first update would be throttled and carry the failed crawl's counts
+        first_message, first_context = progress_callback.call_args_list[0].args
+        self.assertIn("PDF Crawler Started", first_message)
+        self.assertNotIn("downloaded", first_context)
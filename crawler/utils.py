@@ -0,0 +1,9 @@
+from typing import Optional
+
+
+def safe_int(value: Optional[object], default: int = 0) -> int:
+    """Safely cast a value to an integer."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
@@ -1,29 +1,32 @@
-import hashlib
 import logging
-import re
-from datetime import datetime
+import string
 from pathlib import Path
-from urllib.parse import urlparse, urlunparse
+from urllib.parse import urlsplit, urlunsplit
 
 from django.conf import settings
-from django.db import transaction
-from django.http import HttpResponseBadRequest, HttpRequest
+from django.db.models import F, QuerySet
+from django.http import HttpResponseBadRequest, HttpRequest, JsonResponse
 from django.shortcuts import render
 from django.utils import timezone
-from typing import Optional, Tuple  # Import Optional from typing
+from typing import Optional  # Import Optional from typing
 
-from .crawler import crawl_and_download  # Import the crawl logic from the crawler.py file
 from .models import CrawlRun, DownloadedDocument
+from .tasks import ACTIVE_STATES, enqueue_crawl, fail_stale_runs
+from .utils import safe_int
 
 logger = logging.getLogger(__name__)
 
+# Maps every ASCII character not allowed in download directory names to "_"
+_SAFE_PATH_CHARS = frozenset(string.ascii_letters + string.digits + "._-")
+_UNSAFE_PATH_CHARS = str.maketrans({chr(c): "_" for c in range(128) if chr(c) not in _SAFE_PATH_CHARS})
+
 def _build_status(state: str, website: Optional[str] = None, **extra: object) -> dict:
     """Create a normalized status payload for the UI."""
     return {
         "state": state,
         "website": website,
-        "pages_crawled": _safe_int(extra.get("pages_crawled")),
-        "downloaded": _safe_int(extra.get("downloaded")),
+        "pages_crawled": safe_int(extra.get("pages_crawled")),
+        "downloaded": safe_int(extra.get("downloaded")),
         "message": extra.get("message") or "",
         "last_updated": timezone.now().isoformat(),
     }
@@ -45,21 +48,31 @@ def _update_current_status(request: HttpRequest, status: dict) -> dict:
     request.session.modified = True
     return status
 
-def _store_context(request: HttpRequest, context: dict) -> dict:
-    """Persist the latest crawl context in the user's session."""
-    request.session["LAST_CONTEXT"] = context
+def _store_context(request: HttpRequest, context: dict, run_id: Optional[int] = None) -> dict:
+    """Persist the latest crawl context in the user's session.
+
+    Documents are left out; index() reloads them from the database by run id,
+    so the session stays small no matter how many PDFs a crawl found.
+    """
+    request.session["LAST_CONTEXT"] = {key: value for key, value in context.items() if key != "documents"}
+    request.session["LAST_RUN_ID"] = run_id
     request.session.modified = True
     return context
 
 def _sanitize_path_segment(value: str) -> str:
     """Sanitize URL path segment to be used as a directory name."""
-    sanitized = re.sub(r"[^A-Za-z0-9._-]+", "_", value)
+    if not value.isascii():
+        # Non-ASCII characters become "?" first, which the table then maps to "_"
+        value = value.encode("ascii", "replace").decode("ascii")
+    sanitized = value.translate(_UNSAFE_PATH_CHARS)
+    while "__" in sanitized:
+        sanitized = sanitized.replace("__", "_")
     sanitized = sanitized.strip("._-")
     return sanitized or "site"
 
 def _derive_download_directory(base_dir: Path, start_url: str) -> Path:
     """Derive the download directory based on the start URL."""
-    parsed = urlparse(start_url)
+    parsed = urlsplit(start_url)
     host = parsed.hostname or parsed.netloc or start_url
     if host:
         host = host.lower()
@@ -70,14 +83,14 @@ def _derive_download_directory(base_dir: Path, start_url: str) -> Path:
 
 def normalize_start_url(raw_url: str) -> str:
     """Normalize the start URL to ensure it's fully qualified."""
-    parsed = urlparse(raw_url)
+    parsed = urlsplit(raw_url)
     if not parsed.scheme:
         parsed = parsed._replace(scheme="http")
     if not parsed.netloc:
-        parsed = urlparse(f"{parsed.scheme}://{parsed.path}")
+        parsed = urlsplit(f"{parsed.scheme}://{parsed.path}")
     if not parsed.netloc:
         raise ValueError("A valid hostname is required to start crawling.")
-    return urlunparse(parsed)
+    return urlunsplit(parsed)
 
 def parse_limit(value: str, field_name: str) -> Optional[int]:
     """Convert a form value into an optional positive integer."""
@@ -95,95 +108,87 @@ def parse_limit(value: str, field_name: str) -> Optional[int]:
 
     return parsed
 
-def format_downloaded_documents(documents: list) -> list:
-    """Format the downloaded documents for rendering."""
-    formatted = []
-    for doc in documents:
-        path = Path(doc["path"])
-        size_kb = None
-        if path.exists():
-            size_kb = round(path.stat().st_size / 1024, 2)
-
-        downloaded_at = doc.get("downloaded_at")
-        readable_timestamp = downloaded_at
-        if downloaded_at:
-            try:
-                parsed = datetime.fromisoformat(downloaded_at.replace("Z", "+00:00"))
-                readable_timestamp = parsed.strftime("%Y-%m-%d %H:%M:%S %Z") or downloaded_at
-            except ValueError:
-                readable_timestamp = downloaded_at
-
-        formatted.append(
-            {
-                **doc,
-                "filename": path.name if path.name else doc.get("filename"),
-                "size_kb": size_kb,
-                "downloaded_display": readable_timestamp,
-            }
+def _load_run_documents(run_id: int) -> QuerySet:
+    """Load the documents of a stored crawl run, newest first, ready for the template.
+
+    The template evaluates the queryset once ({% if %}, |length and {% for %} share
+    its result cache), so the whole listing is fetched in a single query.
+    """
+    return (
+        DownloadedDocument.objects.filter(run_id=run_id)
+        # Crawler output is not chronological (parallel downloads, cached files keep
+        # their mtime), so order here, where dldoc_run_dlat_idx already has it sorted
+        .order_by("-downloaded_at")
+        .values(
+            "filename",
+            "source_page",
+            "file_size_bytes",
+            "downloaded_at",
+            url=F("pdf_url"),
+            path=F("stored_path"),
+            method=F("download_method"),
         )
-
-    return sorted(
-        formatted,
-        key=lambda item: item.get("downloaded_at") or "",
-        reverse=True,
     )
 
+def _run_status(run: CrawlRun) -> dict:
+    """Build the live status payload from a crawl run row."""
+    return _build_status(
+        run.status,
+        run.start_url,
+        pages_crawled=run.pages_crawled,
+        downloaded=run.pdfs_downloaded,
+        message=run.status_message,
+    )
 
-def _safe_int(value: Optional[object], default: int = 0) -> int:
-    """Safely cast a value to an integer."""
-    try:
-        return int(value)
-    except (TypeError, ValueError):
-        return default
-
-
-from datetime import datetime, timezone
-from typing import Optional
-
-from datetime import datetime, timezone as dt_timezone
-from django.utils import timezone  # Django's module
-
-def _parse_iso_timestamp(raw_value: Optional[str]) -> Optional[datetime]:
-    if not raw_value:
-        return None
-
-    normalized = raw_value.replace("Z", "+00:00")
-    try:
-        parsed = datetime.fromisoformat(normalized)
-    except ValueError:
-        return None
-
-    if timezone.is_naive(parsed):
-        parsed = timezone.make_aware(parsed, dt_timezone.utc)
-
-    return parsed.astimezone(dt_timezone.utc)
-
-
-
+def _run_summary(run: CrawlRun) -> dict:
+    """Build the crawl summary shown once a run has completed."""
+    return {
+        "website_url": run.start_url,
+        "downloaded": run.pdfs_downloaded,
+        "max_pages": run.max_pages,
+        "max_pdfs": run.max_pdfs,
+        "download_directory": run.download_directory,
+        "pages_crawled": run.pages_crawled,
+    }
 
-def _collect_file_metadata(path: Path) -> Tuple[Optional[int], str]:
-    """Return the file size in bytes and SHA-256 hash for the given path."""
-    if not path.exists():
-        return None, ""
+def _run_results(run: CrawlRun) -> dict:
+    """Build the summary and document listing context for a completed run."""
+    return {
+        "message": _run_summary(run),
+        "documents": _load_run_documents(run.pk),
+    }
 
-    size = path.stat().st_size
-    sha256 = hashlib.sha256()
-    with path.open("rb") as file_obj:
-        for chunk in iter(lambda: file_obj.read(8192), b""):
-            sha256.update(chunk)
+def _current_status(request: HttpRequest, run: Optional[CrawlRun]) -> dict:
+    """Return the status of the session's last run, falling back to the stored status."""
+    if run is not None:
+        return _run_status(run)
+    return request.session.get(
+        "CURRENT_STATUS",
+        _build_status("Idle", message="Waiting to start a crawl."),
+    )
 
-    return size, sha256.hexdigest()
+def _last_run(request: HttpRequest) -> Optional[CrawlRun]:
+    """Fetch the crawl run started from this session, if any, failing it if its worker is gone."""
+    run_id = request.session.get("LAST_RUN_ID")
+    run = CrawlRun.objects.filter(pk=run_id).first() if run_id else None
+    if run is not None and run.status in ACTIVE_STATES and fail_stale_runs():
+        run.refresh_from_db()
+    return run
 
 def index(request):
     """Handle the index page request."""
     context = _initial_context()
     context.update(request.session.get("LAST_CONTEXT", {}))
-    context["current_status"] = request.session.get(
-        "CURRENT_STATUS",
-        _build_status("Idle", message="Waiting to start a crawl."),
-    )
+    run = _last_run(request)
+    if run is not None and run.status == "Completed":
+        context.update(_run_results(run))
+    context["current_status"] = _current_status(request, run)
     return render(request, 'index.html', context)
 
+def live_status(request):
+    """Return the status of the session's last crawl for polling clients."""
+    return JsonResponse(_current_status(request, _last_run(request)))
+
 def start_scraping(request):
     """Handle the start scraping request."""
     if request.method == 'POST':
@@ -219,114 +224,52 @@ def start_scraping(request):
             )
             return render(request, 'index.html', context, status=400)
 
-        # Define download directory and start crawling
+
+        # Define download directory and queue the crawl
         base_download_dir: Path = Path(
             getattr(settings, "PDF_DOWNLOAD_ROOT", settings.BASE_DIR / "downloaded_pdfs")
         )
         download_folder = _derive_download_directory(base_download_dir, start_url)
         download_folder.mkdir(parents=True, exist_ok=True)
 
-        # Flag the crawl as running so the status panel reflects live work
-        _update_current_status(
-            request,
-            _build_status(
-                "Running",
-                start_url,
-                pages_crawled=0,
-                downloaded=0,
-                message="Crawling in progress…",
-            ),
-        )
-
         # Allow only the same host to be crawled
-        parsed_start = urlparse(start_url)
+        parsed_start = urlsplit(start_url)
         allowed_hosts = {parsed_start.netloc}
         if parsed_start.hostname:
             allowed_hosts.add(parsed_start.hostname)
 
-        # Call the crawl_and_download function
-        crawl_started_at = timezone.now()
-
-        downloaded_documents, crawl_metadata = crawl_and_download(
-            start_url,
-            download_folder,
-            allowed_hosts=allowed_hosts,
+        crawl_run = CrawlRun.objects.create(
+            start_url=start_url,
+            download_directory=str(download_folder.resolve()),
             max_pages=max_pages,
             max_pdfs=max_pdfs,
-            progress_callback=progress_callback,
+            status="Queued",
+            status_message="Waiting for the crawl worker…",
         )
 
-        crawl_completed_at = timezone.now()
-
-        # Format the documents for rendering
-        documents = format_downloaded_documents(downloaded_documents)
-
-        # Create a message with the crawl summary
-        pages_crawled = _safe_int(crawl_metadata.get("pages_crawled"), 0)
-        current_status = _build_status(
-            "Completed",
+        # The crawl, hashing and database writes happen in the background; the page
+        # polls live_status and shows the results once the run completes
+        enqueue_crawl(
+            crawl_run.pk,
             start_url,
-            pages_crawled=pages_crawled,
-            downloaded=len(downloaded_documents),
-            message="Crawl finished successfully.",
+            str(download_folder),
+            sorted(allowed_hosts),
+            max_pages,
+            max_pdfs,
         )
+        crawl_run.refresh_from_db()
 
-        # Refresh the live status to match the final state
-        _update_current_status(request, current_status)
-
-        message = {
-            "website_url": start_url,
-            "downloaded": len(downloaded_documents),
-            "max_pages": max_pages,
-            "max_pdfs": max_pdfs,
-            "download_directory": str(download_folder.resolve()),
-            "pages_crawled": pages_crawled,
-        }
-
-        # Persist crawl summary and document metadata to the database
-        started_at = _parse_iso_timestamp(crawl_metadata.get("started_at")) or crawl_started_at
-        completed_at = _parse_iso_timestamp(crawl_metadata.get("finished_at")) or crawl_completed_at
-
-        with transaction.atomic():
-            crawl_run = CrawlRun.objects.create(
-                start_url=start_url,
-                download_directory=str(download_folder.resolve()),
-                max_pages=max_pages,
-                max_pdfs=max_pdfs,
-                pages_crawled=pages_crawled,
-                pdfs_downloaded=len(downloaded_documents),
-                started_at=started_at,
-                completed_at=completed_at,
-            )
-
-            for document in downloaded_documents:
-                raw_path = document.get("path")
-                path_value = Path(raw_path) if raw_path else None
-                size_bytes, sha256 = _collect_file_metadata(path_value) if path_value else (None, "")
-
-                DownloadedDocument.objects.create(
-                    run=crawl_run,
-                    pdf_url=document.get("url", ""),
-                    source_page=document.get("source_page", ""),
-                    filename=document.get("filename") or (path_value.name if path_value else "document.pdf"),
-                    stored_path=str(path_value) if path_value else "",
-                    file_size_bytes=size_bytes,
-                    downloaded_at=_parse_iso_timestamp(document.get("downloaded_at")) or completed_at,
-                    download_method=document.get("method", ""),
-                    sha256=sha256,
-                )
-
-        # Store context for session and render
         context = _store_context(
             request,
             {
-                "message": message,
-                "documents": documents,
-                "error": None,
-                "current_status": current_status,
-            }
+                **_initial_context(),
+                "current_status": _run_status(crawl_run),
+            },
+            run_id=crawl_run.pk,
         )
+        if crawl_run.status == "Completed":
+            context.update(_run_results(crawl_run))
 
-        return render(request, 'index.html', context)
+        return render(request, 'index.html', context, status=202)
 
     return HttpResponseBadRequest("Invalid request method.")
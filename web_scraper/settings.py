@@ -76,6 +76,31 @@ DATABASES = {
     }
 }
 
+# -----------------------------
+# CACHE AND SESSIONS
+# -----------------------------
+# Set CACHE_REDIS_URL (e.g. redis://127.0.0.1:6379/1) to share the cache between
+# worker processes; this needs the redis package. Otherwise each process keeps
+# its own in-memory cache.
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_REDIS_URL'],
+        }
+    }
+    # Sessions are read from the shared cache and only fall back to the database on a miss
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    # Per-process caches would serve stale sessions across the FastCGI worker processes,
+    # so sessions stay on the default database backend
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'web-scraper',
+        }
+    }
+
 # -----------------------------
 # PASSWORD VALIDATION
 # -----------------------------
@@ -111,6 +136,20 @@ if not DEBUG:
 PDF_DOWNLOAD_ROOT = BASE_DIR / 'downloaded_pdfs'
 PDF_DOWNLOAD_ROOT.mkdir(parents=True, exist_ok=True)
 
+# -----------------------------
+# BACKGROUND CRAWLS
+# -----------------------------
+# Crawls are queued to a background worker thread; set to run them inside the request instead
+CRAWLER_TASKS_EAGER = os.environ.get("CRAWLER_TASKS_EAGER", "False").lower() in ("1", "true", "yes")
+
+# Queued or running crawls with no progress for this many seconds are marked failed,
+# since a restart loses the worker thread's queue without a trace
+CRAWLER_STALE_RUN_SECONDS = int(os.environ.get("CRAWLER_STALE_RUN_SECONDS", "1800"))
+
+# Take a SHA-256 embedded in a PDF's file name as its digest instead of hashing the file.
+# Only enable this when the crawled sites name their PDFs by content hash; nothing verifies it.
+CRAWLER_TRUST_FILENAME_DIGESTS = os.environ.get("CRAWLER_TRUST_FILENAME_DIGESTS", "False").lower() in ("1", "true", "yes")
+
 # -----------------------------
 # DEFAULT PRIMARY KEY TYPE
 # -----------------------------